@@ -47,6 +47,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'comments.middleware.QueryTimingMiddleware',
+    'comments.routers.PrimaryStickinessMiddleware',
 ]
 
 ROOT_URLCONF = 'comment_tree.urls'
@@ -78,9 +80,31 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            # Seconds to wait for the write lock before "database is locked",
+            # COMMENTS_SQLITE_LOCK_RETRIES more attempts wait as long again.
+            'timeout': 5,
+        },
     }
 }
 
+# Many concurrent readers and a single writer, see comments.sqlite.
+COMMENTS_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,
+}
+
+DATABASE_ROUTERS = ['comments.routers.CommentsRouter']
+
+# Aliases from DATABASES serving reads of the comments app.
+COMMENTS_DB_REPLICAS = []
+
+# The development server is a single process, its local memory cache is
+# shared by every request. Point COMMENTS_HOT_CACHE to memcached or redis
+# before running several workers.
+SILENCED_SYSTEM_CHECKS = ['comments.W001']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
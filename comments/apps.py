@@ -1,7 +1,26 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.core import checks
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_migrate
 
 
 class CommentsConfig(AppConfig):
     name = 'comments'
+
+    def ready(self):
+        from .hotness import check_hot_cache
+        from .models import AbstractTestEntity
+        from .search import reset_fts_available
+        from .sqlite import apply_pragmas
+        from .subscribers import invalidate_subscribers
+
+        checks.register(check_hot_cache)
+        connection_created.connect(apply_pragmas)
+        post_migrate.connect(reset_fts_available, sender=self)
+        for model in self.get_models():
+            if issubclass(model, AbstractTestEntity):
+                m2m_changed.connect(
+                    invalidate_subscribers, sender=model.subscribers.through
+                )
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Substr
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import settings as app_settings
+from .hotness import hot_threads
+from .models import (
+    ArchivedComment, ArchivedThread, Comment, CommentClosure, HistoryComment,
+    ReplyFeedEntry, PATH_STEP, path_range
+)
+from .routers import on_primary
+from .search import index_comment, unindex_comments
+
+
+def cold_roots(days=None):
+    """
+    Ids of thread roots without any created or updated comment for
+    ``days`` days, oldest activity first.
+    """
+    if days is None:
+        days = app_settings.ARCHIVE_AFTER_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    threads = Comment.objects.annotate(root=Substr('path', 1, PATH_STEP))\
+        .values('root').annotate(last=Max('update_at'))\
+        .filter(last__lt=cutoff).order_by('last')
+    return [int(x['root'][:-1]) for x in threads]
+
+
+@on_primary
+def archive_thread(root):
+    """
+    Moves the thread of ``root`` into an ``ArchivedThread`` and returns it.
+    """
+    with transaction.atomic():
+        comments = list(
+            Comment.objects.filter(**path_range(root.path)).order_by('path')
+        )
+        ids = [x.pk for x in comments]
+        in_thread = {
+            'comment__' + k: v for k, v in path_range(root.path).items()
+        }
+        history = HistoryComment.objects.filter(**in_thread).order_by('pk')
+        replies = ReplyFeedEntry.objects.filter(**in_thread).order_by('pk')
+
+        thread = ArchivedThread(
+            root_id=root.pk,
+            owner_type_id=root.owner_type_id,
+            owner_id=root.owner_id,
+            comment_count=len(comments),
+            started_at=root.create_at,
+            last_comment_at=max(x.create_at for x in comments),
+            last_activity_at=max(x.update_at for x in comments)
+        )
+        thread.payload = {
+            'comments': [
+                dict(x.to_dict(False), path=x.path) for x in comments
+            ],
+            'history': [{
+                'chenged': x.chenged_id,
+                'comment': x.comment_id,
+                'json_state': x.json_state,
+                'create_at': x.create_at.isoformat(),
+                'update_at': x.update_at.isoformat()
+            } for x in history],
+            'replies': [{
+                'id': x.pk,
+                'user': x.user_id,
+                'comment': x.comment_id
+            } for x in replies]
+        }
+        thread.save()
+        ArchivedComment.objects.bulk_create([
+            ArchivedComment(id=x.pk, thread=thread, user_id=x.user_id)
+            for x in comments
+        ])
+
+        unindex_comments(ids)
+        # Closures, history and feed entries go with the comments
+        Comment.objects.filter(**path_range(root.path)).delete()
+    hot_threads.invalidate(root.pk)
+    return thread
+
+
+def archive_cold_threads(days=None, limit=None):
+    """
+    Archives threads inactive for ``days`` days, returns the archives.
+    """
+    archived = []
+    for root_id in cold_roots(days)[:limit]:
+        root = Comment.objects.filter(pk=root_id).first()
+        if root is not None:
+            archived.append(archive_thread(root))
+    return archived
+
+
+@on_primary
+def restore_thread(comment_id):
+    """
+    Moves the archived thread holding ``comment_id`` back to the live
+    tables. Returns False when the comment is not archived.
+    """
+    with transaction.atomic():
+        thread = ArchivedThread.objects.filter(comments__id=comment_id)\
+            .first()
+        if thread is None:
+            return False
+        payload = thread.payload
+        comments = [Comment(
+            id=x['id'], user_id=x['user'], parent_id=x['parent'],
+            owner_type_id=x['owner_type'], owner_id=x['owner_id'],
+            body=x['body'], path=x['path']
+        ) for x in payload['comments']]
+        Comment.objects.bulk_create(comments)
+        CommentClosure.objects.bulk_create([
+            CommentClosure(parent_id=parent_id, child_id=x.pk, depth=depth)
+            for x in comments
+            for depth, parent_id in enumerate(
+                reversed(x.ancestor_ids() + [x.pk])
+            )
+        ])
+        # Saving fills auto_now fields with the current time, the original
+        # ones are written back with an update
+        for x in payload['comments']:
+            Comment.objects.filter(pk=x['id']).update(
+                create_at=parse_datetime(x['create_at']),
+                update_at=parse_datetime(x['update_at'])
+            )
+        for x in payload['history']:
+            history = HistoryComment.objects.create(
+                chenged_id=x['chenged'], comment_id=x['comment'],
+                json_state=x['json_state']
+            )
+            HistoryComment.objects.filter(pk=history.pk).update(
+                create_at=parse_datetime(x['create_at']),
+                update_at=parse_datetime(x['update_at'])
+            )
+        # Feed entries keep their ids and with them their place in the
+        # feeds, entries pushed out by newer replies meanwhile are dropped
+        replies = payload.get('replies', [])
+        ReplyFeedEntry.objects.bulk_create([
+            ReplyFeedEntry(id=x['id'], user_id=x['user'],
+                           comment_id=x['comment'])
+            for x in replies
+        ])
+        for user_id in set(x['user'] for x in replies):
+            ReplyFeedEntry.trim(user_id)
+        for comment in comments:
+            index_comment(comment)
+        thread.delete()
+    hot_threads.invalidate(thread.root_id)
+    return True
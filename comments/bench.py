@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function, division
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from threading import Thread
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import settings as app_settings
+from .models import Comment, Post, Photo
+from .routers import on_primary
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name, **overrides):
+    """
+    Registers a benchmark case. The decorated function receives the seeded
+    forest and returns ``(method, url, kwargs)`` for one client request.
+    ``overrides`` are app settings applied while the case runs.
+    """
+    def wrapper(func):
+        func.overrides = overrides
+        BENCHMARKS[name] = func
+        return func
+    return wrapper
+
+
+@on_primary
+def seed_forest(posts=10, photos=10, users=10, roots=3, fanout=3, depth=3,
+                subscribers=2, seed=0):
+    """
+    Creates a synthetic forest through the ORM. Every entity gets up to
+    ``roots`` threads, every comment up to ``fanout`` replies and every
+    thread a random depth of at most ``depth`` levels.
+    """
+    rnd = random.Random(seed)
+    user_model = get_user_model()
+    offset = user_model.objects.count()
+    user_list = [
+        user_model.objects.create(username='bench_{}'.format(offset + i))
+        for i in range(users)
+    ]
+    entities = [Post.objects.create() for _ in range(posts)] + \
+        [Photo.objects.create() for _ in range(photos)]
+
+    forest = {'users': user_list, 'entities': entities, 'comments': []}
+    for entity in entities:
+        entity.subscribers.add(
+            *rnd.sample(user_list, min(subscribers, len(user_list)))
+        )
+        for _ in range(rnd.randint(1, roots)):
+            root = Comment(
+                owner=entity, user=rnd.choice(user_list),
+                body='Bench comment for {}'.format(entity)
+            )
+            root.save()
+            forest['comments'].append(root)
+            level, max_depth = [root], rnd.randint(1, depth)
+            for _ in range(max_depth - 1):
+                next_level = []
+                for parent in level:
+                    for _ in range(rnd.randint(0, fanout)):
+                        comment = Comment(
+                            parent=parent, user=rnd.choice(user_list),
+                            body='Bench reply for #{}'.format(parent.pk)
+                        )
+                        comment.save()
+                        next_level.append(comment)
+                forest['comments'].extend(next_level)
+                level = next_level
+    return forest
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    index = int(round((len(values) - 1) * p / 100.0))
+    return values[index]
+
+
+def summarize(timings, queries):
+    return OrderedDict([
+        ('runs', len(timings)),
+        ('min_ms', min(timings)),
+        ('mean_ms', sum(timings) / len(timings)),
+        ('p50_ms', percentile(timings, 50)),
+        ('p90_ms', percentile(timings, 90)),
+        ('p99_ms', percentile(timings, 99)),
+        ('max_ms', max(timings)),
+        ('queries_min', min(queries)),
+        ('queries_max', max(queries)),
+        ('queries_mean', sum(queries) / len(queries)),
+    ])
+
+
+def run_benchmarks(forest, repeat=10, only=None, client=None):
+    """
+    Runs registered cases against the seeded forest. Returns an ordered
+    mapping of case name to latency percentiles and query counts.
+    """
+    client = client or Client()
+    results = OrderedDict()
+    for name, case in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        timings, queries = [], []
+        previous = {k: getattr(app_settings, k) for k in case.overrides}
+        for key, value in case.overrides.items():
+            setattr(app_settings, key, value)
+        try:
+            for _ in range(repeat):
+                method, url, kwargs = case(forest)
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.time()
+                    response = getattr(client, method)(url, **kwargs)
+                    timings.append((time.time() - start) * 1000)
+                if response.status_code >= 400:
+                    raise AssertionError('{} returned {}'.format(
+                        name, response.status_code
+                    ))
+                queries.append(len(ctx.captured_queries))
+        finally:
+            for key, value in previous.items():
+                setattr(app_settings, key, value)
+        results[name] = summarize(timings, queries)
+    return results
+
+
+def run_write_load(forest, threads=8, writes=20):
+    """
+    Creates comments from ``threads`` concurrent clients and returns the
+    achieved throughput. Needs a file database shared by all threads.
+    """
+    method, url, kwargs = BENCHMARKS['create'](forest)
+    errors = []
+
+    def worker():
+        client = Client()
+        try:
+            for _ in range(writes):
+                try:
+                    response = getattr(client, method)(url, **kwargs)
+                except Exception as e:
+                    errors.append(repr(e))
+                    continue
+                if response.status_code != 302:
+                    errors.append(response.status_code)
+        finally:
+            connection.close()
+
+    workers = [Thread(target=worker) for _ in range(threads)]
+    start = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    seconds = time.time() - start
+    return OrderedDict([
+        ('threads', threads),
+        ('writes', threads * writes),
+        ('errors', len(errors)),
+        ('seconds', seconds),
+        ('writes_per_sec', (threads * writes - len(errors)) / seconds),
+    ])
+
+
+IMPORT_SCRIPT = (
+    'import time; start = time.time(); import django; django.setup(); '
+    'from importlib import import_module; '
+    '[import_module(x) for x in {modules!r}]; print(time.time() - start)'
+)
+
+
+def slowest_imports(importtime, prefix='comments', top=10):
+    """
+    Parses ``-X importtime`` output into the ``top`` slowest modules under
+    ``prefix`` by cumulative microseconds.
+    """
+    rows = []
+    for line in importtime.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        if name.startswith(prefix):
+            rows.append((name, int(parts[1])))
+    return OrderedDict(sorted(rows, key=lambda x: -x[1])[:top])
+
+
+def measure_import_time(modules=('comments.urls',), repeat=5):
+    """
+    Worker cold-start cost: milliseconds to set up Django and import
+    ``modules`` in a fresh interpreter. Interpreters with ``-X importtime``
+    (Python 3.7+) also report the slowest app modules.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+    script = IMPORT_SCRIPT.format(modules=[str(x) for x in modules])
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         env=env)
+        timings.append(float(output.strip().splitlines()[-1]) * 1000)
+    result = OrderedDict([
+        ('modules', list(modules)),
+        ('runs', repeat),
+        ('min_ms', min(timings)),
+        ('p50_ms', percentile(timings, 50)),
+        ('max_ms', max(timings)),
+    ])
+    if sys.version_info >= (3, 7):
+        process = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', '-c', script], env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        _, importtime = process.communicate()
+        result['slowest_us'] = slowest_imports(importtime.decode())
+    return result
+
+
+def compare(baseline, results):
+    """
+    Returns per-case ratios of p50 latency and query deltas of ``results``
+    against a ``baseline`` report.
+    """
+    diff = OrderedDict()
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        diff[name] = OrderedDict([
+            ('p50_ratio', current['p50_ms'] / (previous['p50_ms'] or 1e-9)),
+            ('queries_delta',
+             current['queries_mean'] - previous['queries_mean']),
+        ])
+    return diff
+
+
+def _root(forest):
+    return forest['comments'][0]
+
+
+def _dump(forest):
+    response = Client().post(
+        reverse('comments_dump'), data={'user': forest['users'][0].pk}
+    )
+    return json.loads(response.content)['id']
+
+
+def _leaf(forest):
+    comment = Comment(
+        parent=_root(forest), user=forest['users'][0], body='Bench leaf'
+    )
+    comment.save()
+    return comment
+
+
+@benchmark('list')
+def bench_list(forest):
+    return 'get', reverse('comment_list'), {}
+
+
+@benchmark('list_full_tree')
+def bench_list_full_tree(forest):
+    return 'get', '{}?full_tree=1'.format(reverse('comment_list')), {}
+
+
+@benchmark('list_by_owner')
+def bench_list_by_owner(forest):
+    entity = forest['entities'][0]
+    return 'get', '{}?owner_type={}&owner_id={}'.format(
+        reverse('comment_list'),
+        ContentType.objects.get_for_model(entity).pk, entity.pk
+    ), {}
+
+
+@benchmark('create')
+def bench_create(forest):
+    entity = forest['entities'][0]
+    return 'post', reverse('comment_list'), {
+        'data': json.dumps({
+            'body': 'Bench create',
+            'user': forest['users'][0].pk,
+            'owner_type': ContentType.objects.get_for_model(entity).pk,
+            'owner_id': entity.pk
+        }),
+        'content_type': 'application/json'
+    }
+
+
+@benchmark('detail')
+def bench_detail(forest):
+    return 'get', _root(forest).get_absolute_url(), {}
+
+
+@benchmark('detail_full_tree')
+def bench_detail_full_tree(forest):
+    return 'get', '{}?full_tree=1'.format(
+        _root(forest).get_absolute_url()
+    ), {}
+
+
+@benchmark('detail_hot', HOT_READ_THRESHOLD=1)
+def bench_detail_hot(forest):
+    url = '{}?full_tree=1'.format(_root(forest).get_absolute_url())
+    # The first read makes the thread hot and caches its tree
+    Client().get(url)
+    return 'get', url, {}
+
+
+@benchmark('update')
+def bench_update(forest):
+    root = _root(forest)
+    return 'put', root.get_absolute_url(), {
+        'data': json.dumps({
+            'body': 'Bench update',
+            'user': root.user_id,
+            'owner_type': root.owner_type_id,
+            'owner_id': root.owner_id
+        }),
+        'content_type': 'application/json'
+    }
+
+
+@benchmark('delete')
+def bench_delete(forest):
+    return 'delete', _leaf(forest).get_absolute_url(), {}
+
+
+@benchmark('thread')
+def bench_thread(forest):
+    return 'get', reverse('comment_thread', args=(_root(forest).pk,)), {}
+
+
+@benchmark('batch')
+def bench_batch(forest):
+    return 'post', reverse('comments_batch'), {
+        'data': json.dumps({'items': [
+            {'id': x.pk, 'full_tree': x.parent_id is None}
+            for x in forest['comments'][:20]
+        ]}),
+        'content_type': 'application/json'
+    }
+
+
+@benchmark('user_comments')
+def bench_user_comments(forest):
+    return 'get', reverse('user_comments', args=(forest['users'][0].pk,)), {}
+
+
+@benchmark('user_replies')
+def bench_user_replies(forest):
+    return 'get', reverse('user_replies', args=(_root(forest).user_id,)), {}
+
+
+@benchmark('search')
+def bench_search(forest):
+    return 'get', '{}?q=bench+reply'.format(reverse('comments_search')), {}
+
+
+@benchmark('summary')
+def bench_summary(forest):
+    return 'get', '{}?owners={}'.format(reverse('comments_summary'), ','.join(
+        '{}:{}'.format(ContentType.objects.get_for_model(x).pk, x.pk)
+        for x in forest['entities']
+    )), {}
+
+
+@benchmark('dump_create')
+def bench_dump_create(forest):
+    return 'post', reverse('comments_dump'), {
+        'data': {'user': forest['users'][0].pk}
+    }
+
+
+@benchmark('dump_list')
+def bench_dump_list(forest):
+    _dump(forest)
+    return 'get', '{}?user={}'.format(
+        reverse('comments_dump'), forest['users'][0].pk
+    ), {}
+
+
+@benchmark('dump_result')
+def bench_dump_result(forest):
+    return 'get', reverse('comments_dump_result', args=(_dump(forest),)), {}
+
+
+@benchmark('metrics', METRICS_ENABLED=True)
+def bench_metrics(forest):
+    return 'get', reverse('comments_metrics'), {}
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+from array import array
+from bisect import bisect_left
+from heapq import merge
+
+from django.utils.six.moves import range, zip
+
+from .models import Comment, PATH_STEP, path_range
+
+
+class CompactTree(object):
+    """
+    Subtree of a comment stored as parallel ``array('l')`` columns in
+    depth-first order, without a model instance or dict per node. Nodes
+    are addressed by their index; ``parent``, ``first_child`` and
+    ``next_sibling`` hold indexes too, -1 when missing. Other fields are
+    loaded on demand in chunks.
+    """
+    def __init__(self):
+        self.ids = array('l')
+        self.parent = array('l')
+        self.depth = array('l')
+        self.first_child = array('l')
+        self.next_sibling = array('l')
+        # Last node on every depth of the current branch, the previous
+        # sibling of the next node on that depth
+        self._last = []
+        self._sorted_ids = None
+        self._by_id = None
+
+    @classmethod
+    def from_comment(cls, root, chunk_size=2000):
+        """
+        Builds the tree of ``root`` reading ``(id, path)`` rows in path
+        order, ``chunk_size`` rows per query.
+        """
+        tree = cls()
+        qs = Comment.objects.filter(**path_range(root.path)).order_by('path')
+        last_path = None
+        while True:
+            chunk = qs if last_path is None else qs.filter(path__gt=last_path)
+            rows = list(chunk.values_list('id', 'path')[:chunk_size])
+            for pk, path in rows:
+                tree.append(pk, (len(path) - len(root.path)) // PATH_STEP)
+            if len(rows) < chunk_size:
+                return tree
+            last_path = rows[-1][1]
+
+    def append(self, pk, depth):
+        """
+        Adds the next node in depth-first order, ``depth`` is relative to
+        the first node.
+        """
+        index = len(self.ids)
+        parent = self._last[depth - 1] if depth else -1
+        self.ids.append(pk)
+        self.parent.append(parent)
+        self.depth.append(depth)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        if len(self._last) > depth:
+            self.next_sibling[self._last[depth]] = index
+        elif parent >= 0:
+            self.first_child[parent] = index
+        del self._last[depth:]
+        self._last.append(index)
+        self._sorted_ids = self._by_id = None
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def dfs(self, index=0):
+        """
+        Indexes of ``index`` and its descendants in depth-first order.
+        """
+        return range(*self.subtree(index))
+
+    def children(self, index):
+        child = self.first_child[index]
+        while child >= 0:
+            yield child
+            child = self.next_sibling[child]
+
+    def subtree(self, index):
+        """
+        Returns the ``(start, end)`` slice of the depth-first order that
+        holds ``index`` and its descendants.
+        """
+        end, depth = index + 1, self.depth[index]
+        while end < len(self.ids) and self.depth[end] > depth:
+            end += 1
+        return index, end
+
+    def ancestors(self, index):
+        """
+        Indexes of the ancestors of ``index``, nearest first.
+        """
+        index = self.parent[index]
+        while index >= 0:
+            yield index
+            index = self.parent[index]
+
+    def index(self, pk):
+        """
+        Index of the node with id ``pk``, found by bisecting a sorted copy
+        of the ids built on first use.
+        """
+        if self._sorted_ids is None:
+            self._build_index()
+        position = bisect_left(self._sorted_ids, pk)
+        if position == len(self._sorted_ids) or \
+                self._sorted_ids[position] != pk:
+            raise KeyError(pk)
+        return self._by_id[position]
+
+    def _build_index(self, run_size=65536):
+        # Sorted runs of (id, index) pairs are kept in arrays and merged,
+        # only one run exists as Python objects at a time
+        runs = []
+        for start in range(0, len(self.ids), run_size):
+            end = min(start + run_size, len(self.ids))
+            run = sorted(zip(self.ids[start:end], range(start, end)))
+            runs.append((array('l', (x[0] for x in run)),
+                         array('l', (x[1] for x in run))))
+            del run
+        self._sorted_ids, self._by_id = array('l'), array('l')
+        for pk, index in merge(*[zip(*x) for x in runs]):
+            self._sorted_ids.append(pk)
+            self._by_id.append(index)
+
+    def values(self, fields=('body',), start=0, end=None, chunk_size=500):
+        """
+        Yields ``(index, values)`` of nodes ``start:end`` in depth-first
+        order, loading ``fields`` of ``chunk_size`` comments per query.
+        """
+        end = len(self.ids) if end is None else end
+        for offset in range(start, end, chunk_size):
+            ids = self.ids[offset:min(offset + chunk_size, end)].tolist()
+            rows = {
+                x[0]: x[1:] for x in Comment.objects.filter(pk__in=ids)
+                .values_list('id', *fields)
+            }
+            for index, pk in enumerate(ids, offset):
+                if pk in rows:
+                    yield index, rows[pk]
+
+    def comments(self, start=0, end=None, chunk_size=500):
+        """
+        Yields ``(index, comment)`` of nodes ``start:end`` in depth-first
+        order, loading ``chunk_size`` model instances per query. Comments
+        deleted meanwhile are skipped with their whole subtree, so every
+        yielded comment follows its parent.
+        """
+        end = len(self.ids) if end is None else end
+        offset = skip = start
+        while offset < end:
+            ids = self.ids[offset:min(offset + chunk_size, end)].tolist()
+            comments = Comment.objects.in_bulk(ids)
+            for index, pk in enumerate(ids, offset):
+                if index < skip:
+                    continue
+                if pk in comments:
+                    yield index, comments[pk]
+                else:
+                    skip = self.subtree(index)[1]
+            offset = max(offset + len(ids), skip)
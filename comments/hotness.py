@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function, division
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from . import settings as app_settings
+from .routers import primary
+
+
+def render_tree(comment):
+    return json.dumps(comment.to_dict(True), cls=DjangoJSONEncoder)
+
+
+def check_hot_cache(app_configs, **kwargs):
+    """
+    System check warning about a per-process ``COMMENTS_HOT_CACHE``: other
+    workers would keep serving trees they never saw invalidated.
+    """
+    if isinstance(caches[app_settings.HOT_CACHE], LocMemCache):
+        return [checks.Warning(
+            'COMMENTS_HOT_CACHE uses a per-process LocMemCache.',
+            hint='Point it to a cache shared by all workers, e.g. '
+                 'memcached or redis, unless a single process serves '
+                 'the comments.',
+            id='comments.W001',
+        )]
+    return []
+
+
+class SpaceSaving(object):
+    """
+    Space-Saving top-K sketch: keeps at most ``capacity`` counters and
+    replaces the smallest one when a new key arrives, so every heavy
+    hitter is tracked with an error bounded by the replaced count.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+
+    def offer(self, key, weight=1):
+        """
+        Counts ``key`` and returns the key evicted for it, if any.
+        """
+        evicted = None
+        if key not in self.counts and len(self.counts) >= self.capacity:
+            evicted = min(self.counts, key=self.counts.get)
+            self.counts[key] = self.counts.pop(evicted)
+        self.counts[key] = self.counts.get(key, 0) + weight
+        return evicted
+
+    def decay(self, factor=0.5):
+        self.counts = {k: v * factor for k, v in self.counts.items()
+                       if v * factor >= 1}
+
+    def get(self, key):
+        return self.counts.get(key, 0)
+
+    def top(self, n=None):
+        return sorted(self.counts.items(), key=lambda x: -x[1])[:n]
+
+
+class HotThreadTracker(object):
+    """
+    Tracks reads and writes per thread root. A thread is hot while its
+    reads or writes within a decay window cross the configured thresholds.
+    Hot threads get pre-rendered trees and coalesced notifications. Trees
+    live in ``COMMENTS_HOT_CACHE``, which must be shared by all workers.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        capacity = app_settings.HOT_THREADS_CAPACITY
+        self.reads = SpaceSaving(capacity)
+        self.writes = SpaceSaving(capacity)
+        self.hot = set()
+        self.decayed_at = time.time()
+
+    @property
+    def cache(self):
+        return caches[app_settings.HOT_CACHE]
+
+    def _is_hot(self, root_id):
+        return self.reads.get(root_id) >= app_settings.HOT_READ_THRESHOLD or \
+            self.writes.get(root_id) >= app_settings.HOT_WRITE_THRESHOLD
+
+    def _record(self, sketch, root_id):
+        if root_id is None:
+            return
+        with self._lock:
+            if time.time() - self.decayed_at >= \
+                    app_settings.HOT_DECAY_SECONDS:
+                self.reads.decay()
+                self.writes.decay()
+                self.decayed_at = time.time()
+                cold = set(x for x in self.hot if not self._is_hot(x))
+            else:
+                cold = set()
+            evicted = sketch.offer(root_id)
+            if evicted is not None and not self._is_hot(evicted):
+                cold.add(evicted)
+            if self._is_hot(root_id):
+                self.hot.add(root_id)
+            cold &= self.hot
+            self.hot -= cold
+        for key in cold:
+            self.invalidate(key)
+
+    def record_read(self, root_id):
+        self._record(self.reads, root_id)
+
+    def record_write(self, root_id):
+        """
+        Counts a write and drops the trees of its thread once it commits:
+        a reader rendering the thread before the commit still sees the old
+        comments, so an earlier version bump would let it cache them under
+        the new version.
+        """
+        self._record(self.writes, root_id)
+        transaction.on_commit(lambda: self.prerender(root_id),
+                              using=app_settings.DB_PRIMARY)
+
+    def is_hot(self, root_id):
+        return root_id in self.hot
+
+    def version(self, root_id):
+        return self.cache.get('comments:hot:version:{}'.format(root_id), 0)
+
+    def invalidate(self, root_id):
+        """
+        Drops pre-rendered trees of a thread by bumping its version.
+        """
+        key = 'comments:hot:version:{}'.format(root_id)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, 1, None)
+
+    def tree_key(self, comment):
+        root_id = comment.root_id
+        return 'comments:hot:tree:{}:{}:{}'.format(
+            root_id, self.version(root_id), comment.pk
+        )
+
+    def rendered_tree(self, comment):
+        """
+        Returns the cached JSON tree of ``comment`` in a hot thread,
+        rendering it on a miss. None when the thread is not hot.
+        """
+        if not self.is_hot(comment.root_id):
+            return None
+        key = self.tree_key(comment)
+        rendered = self.cache.get(key)
+        if rendered is None:
+            rendered = render_tree(comment)
+            self.cache.set(key, rendered, app_settings.HOT_CACHE_TIMEOUT)
+        return rendered
+
+    def prerender(self, root_id):
+        """
+        Drops the trees of a thread right after a committed write and
+        renders the new tree of a hot one, readers of the root never wait
+        for it.
+        """
+        from .models import Comment
+
+        self.invalidate(root_id)
+        if not self.is_hot(root_id):
+            return
+        with primary():
+            root = Comment.objects.filter(pk=root_id).first()
+            if root is not None:
+                self.cache.set(self.tree_key(root), render_tree(root),
+                               app_settings.HOT_CACHE_TIMEOUT)
+
+    def snapshot(self):
+        with self._lock:
+            roots = set(self.hot) | set(
+                k for k, _ in self.reads.top(10) + self.writes.top(10)
+            )
+            window = max(time.time() - self.decayed_at, 1)
+            return [
+                OrderedDict([
+                    ('root_id', root_id),
+                    ('hot', root_id in self.hot),
+                    ('reads', self.reads.get(root_id)),
+                    ('writes', self.writes.get(root_id)),
+                    ('reads_per_sec', self.reads.get(root_id) / window),
+                    ('writes_per_sec', self.writes.get(root_id) / window),
+                ])
+                for root_id in sorted(
+                    roots, key=lambda x: -self.reads.get(x) - self.writes.get(x)
+                )
+            ]
+
+
+hot_threads = HotThreadTracker()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+from django.utils import six
+from django.utils.lru_cache import lru_cache
+from django.utils.module_loading import import_string
+
+from . import settings as app_settings
+
+
+@lru_cache(maxsize=None)
+def _import(path):
+    return import_string(path)
+
+
+def load(obj):
+    """
+    Resolves a dotted path setting on first use, other values are
+    returned as is.
+    """
+    if isinstance(obj, six.string_types):
+        return _import(obj)
+    return obj
+
+
+def dump_backends():
+    return [load(x) for x in app_settings.DUMP_BACKENDS]
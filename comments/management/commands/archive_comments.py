@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...archive import archive_cold_threads, restore_thread
+
+
+class Command(BaseCommand):
+    help = 'Moves inactive comment threads to the archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='Archive threads inactive for this many days, '
+                 'COMMENTS_ARCHIVE_AFTER_DAYS by default.'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help='Archive at most this many threads.'
+        )
+        parser.add_argument(
+            '--restore', type=int, metavar='COMMENT_ID',
+            help='Restore the archived thread of a comment instead.'
+        )
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            if not restore_thread(options['restore']):
+                raise CommandError(
+                    'Comment #{} is not archived'.format(options['restore'])
+                )
+            self.stdout.write('Restored thread of #{}'.format(
+                options['restore']
+            ))
+            return
+        threads = archive_cold_threads(options['days'], options['limit'])
+        self.stdout.write('Archived {} threads, {} comments'.format(
+            len(threads), sum(x.comment_count for x in threads)
+        ))
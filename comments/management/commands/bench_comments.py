@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from ...bench import (
+    BENCHMARKS, seed_forest, run_benchmarks, run_write_load, compare,
+    measure_import_time
+)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Seeds a synthetic comment forest in a throwaway test database ' \
+           'and benchmarks every comments endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=10)
+        parser.add_argument('--photos', type=int, default=10)
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--roots', type=int, default=3,
+                            help='Max threads per entity.')
+        parser.add_argument('--fanout', type=int, default=3,
+                            help='Max replies per comment.')
+        parser.add_argument('--depth', type=int, default=3,
+                            help='Max depth of a thread.')
+        parser.add_argument('--subscribers', type=int, default=2,
+                            help='Subscribers per entity.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--only', nargs='*', choices=BENCHMARKS.keys(),
+                            help='Run only the given cases.')
+        parser.add_argument('--write-load', type=int, default=0,
+                            metavar='THREADS',
+                            help='Also measure concurrent comment creation.')
+        parser.add_argument('--writes', type=int, default=20,
+                            help='Writes per thread for --write-load.')
+        parser.add_argument('--import-time', action='store_true',
+                            help='Also measure the cold-start import time '
+                                 'of a worker.')
+        parser.add_argument('--output', help='Write JSON report to file.')
+        parser.add_argument('--compare',
+                            help='Baseline JSON report to compare with.')
+
+    def handle(self, *args, **options):
+        params = OrderedDict(
+            (k, options[k]) for k in (
+                'posts', 'photos', 'users', 'roots', 'fanout', 'depth',
+                'subscribers', 'seed', 'repeat'
+            )
+        )
+        media_root = tempfile.mkdtemp()
+        write_load = None
+        if options['write_load'] and connection.vendor == 'sqlite':
+            # Threads do not share an in-memory database.
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                media_root, 'bench.sqlite3'
+            )
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True
+        )
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                forest = seed_forest(**{
+                    k: v for k, v in params.items() if k != 'repeat'
+                })
+                results = run_benchmarks(
+                    forest, repeat=options['repeat'], only=options['only']
+                )
+                if options['write_load']:
+                    write_load = run_write_load(
+                        forest, options['write_load'], options['writes']
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        report = OrderedDict([
+            ('meta', OrderedDict([
+                ('created_at', timezone.now().isoformat()),
+                ('revision', git_revision()),
+                ('python', platform.python_version()),
+                ('vendor', connection.vendor),
+                ('comments', len(forest['comments'])),
+                ('params', params),
+            ])),
+            ('results', results),
+        ])
+        if write_load:
+            report['write_load'] = write_load
+        if options['import_time']:
+            report['import_time'] = measure_import_time(
+                repeat=options['repeat']
+            )
+        if options['compare']:
+            with open(options['compare']) as fin:
+                baseline = json.load(fin)
+            report['compare'] = compare(baseline['results'], results)
+            if options['import_time'] and 'import_time' in baseline:
+                report['compare']['import_time'] = OrderedDict([
+                    ('p50_ratio', report['import_time']['p50_ms'] /
+                     (baseline['import_time']['p50_ms'] or 1e-9)),
+                ])
+
+        data = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fout:
+                fout.write(data)
+        self.stdout.write(data)
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...search import fts_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text index of comment bodies.'
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError('Full-text index needs SQLite with FTS5')
+        with transaction.atomic():
+            count = rebuild_index()
+        self.stdout.write('Indexed {} comments'.format(count))
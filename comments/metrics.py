@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function, division
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+from collections import OrderedDict
+from threading import Lock
+
+FIELDS = ('total_ms', 'db_ms', 'encode_ms', 'queries', 'tree_size')
+
+
+class MetricsRegistry(object):
+    """
+    In-process aggregate of request samples keyed by view name.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._views = {}
+
+    def record(self, view, sample, slow=False):
+        with self._lock:
+            stats = self._views.setdefault(view, dict(
+                count=0, slow=0, max_ms=0.0, **{f: 0 for f in FIELDS}
+            ))
+            stats['count'] += 1
+            stats['slow'] += int(slow)
+            stats['max_ms'] = max(stats['max_ms'], sample['total_ms'])
+            for field in FIELDS:
+                stats[field] += sample.get(field, 0)
+
+    def snapshot(self):
+        with self._lock:
+            views = {k: dict(v) for k, v in self._views.items()}
+        result = OrderedDict()
+        for view in sorted(views):
+            stats = views[view]
+            result[view] = OrderedDict([
+                ('count', stats['count']),
+                ('slow', stats['slow']),
+                ('max_ms', stats['max_ms']),
+            ])
+            for field in FIELDS:
+                result[view]['avg_' + field] = \
+                    stats[field] / stats['count']
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = MetricsRegistry()
+
+
+def count_nodes(data):
+    """
+    Returns the number of comments in a serialized response.
+    """
+    if isinstance(data, list):
+        return sum(count_nodes(x) for x in data)
+    if not isinstance(data, dict):
+        return 0
+    if 'object_list' in data:
+        return count_nodes(data['object_list'])
+    if 'id' in data:
+        return 1 + count_nodes(data.get('childs', []))
+    return 0
+
+
+def server_timing(sample):
+    return ', '.join([
+        'db;dur={:.2f};desc="{} queries"'.format(
+            sample['db_ms'], sample['queries']
+        ),
+        'encode;dur={:.2f}'.format(sample['encode_ms']),
+        'total;dur={:.2f}'.format(sample['total_ms']),
+    ])
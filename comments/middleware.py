@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function, division
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+import logging
+import random
+import time
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+from . import settings as app_settings
+from .metrics import registry, server_timing
+
+logger = logging.getLogger('comments.metrics')
+
+
+class QueryCounter(object):
+    """
+    Cursor wrapper counting queries and their time, keeping the SQL only
+    when ``sql`` is a list.
+    """
+    def __init__(self, cursor, stats):
+        self.cursor = cursor
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _timed(self, method, sql, params):
+        start = time.time()
+        try:
+            return method(sql, params)
+        finally:
+            duration = (time.time() - start) * 1000
+            self.stats['queries'] += 1
+            self.stats['db_ms'] += duration
+            if self.stats['sql'] is not None:
+                self.stats['sql'].append((duration, sql))
+
+    def execute(self, sql, params=None):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+
+def count_queries(stats):
+    """
+    Wraps cursors of every connection of the current thread, returns a
+    function undoing it. Connections are thread-local, so this does not
+    leak into other requests.
+    """
+    patched = []
+    for alias in connections:
+        connection = connections[alias]
+        if 'cursor' in connection.__dict__:
+            continue
+        make_cursor = connection.cursor
+        connection.cursor = \
+            lambda make_cursor=make_cursor: QueryCounter(make_cursor(), stats)
+        patched.append(connection)
+
+    def restore():
+        for connection in patched:
+            del connection.cursor
+    return restore
+
+
+def is_comments_view(request):
+    try:
+        match = resolve(request.path_info, getattr(request, 'urlconf', None))
+    except Resolver404:
+        return None
+    view = getattr(match.func, 'view_class', None)
+    if view is None or not view.__module__.startswith('comments.'):
+        return None
+    return match
+
+
+class QueryTimingMiddleware(object):
+    """
+    Records query count, DB time, JSON encoding time and tree size of
+    every request served by the comments views.
+
+    Disabled unless ``COMMENTS_METRICS_ENABLED`` is set.
+    """
+    def __init__(self, get_response):
+        if not app_settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        match = is_comments_view(request)
+        if match is None:
+            return self.get_response(request)
+
+        # SQL text is only kept for requests that may be logged
+        sampled = random.random() < app_settings.METRICS_SAMPLE_RATE
+        stats = {'queries': 0, 'db_ms': 0.0, 'sql': [] if sampled else None}
+        request.comments_metrics = {'encode_ms': 0.0, 'tree_size': 0}
+        restore = count_queries(stats)
+        start = time.time()
+        try:
+            response = self.get_response(request)
+        finally:
+            total_ms = (time.time() - start) * 1000
+            restore()
+
+        sample = dict(
+            request.comments_metrics, total_ms=total_ms,
+            db_ms=stats['db_ms'], queries=stats['queries']
+        )
+        slow = total_ms >= app_settings.METRICS_SLOW_MS or \
+            stats['queries'] >= app_settings.METRICS_SLOW_QUERIES
+        registry.record(match.url_name, sample, slow)
+        response['Server-Timing'] = server_timing(sample)
+
+        if slow and sampled:
+            logger.warning(
+                'Slow request %s %s: %.1f ms, %d queries, %.1f ms in DB\n%s',
+                request.method, request.get_full_path(), total_ms,
+                stats['queries'], stats['db_ms'],
+                '\n'.join('{:.3f} ms: {}'.format(*x) for x in stats['sql'])
+            )
+        return response
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-19 14:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    comments = Comment.objects.using(schema_editor.connection.alias)
+    level = comments.filter(parent__isnull=True)
+    prefixes = {None: ''}
+    while level.exists():
+        paths = {}
+        for comment in level.only('pk', 'parent_id'):
+            paths[comment.pk] = '{}{:010d}/'.format(
+                prefixes[comment.parent_id], comment.pk
+            )
+            comments.filter(pk=comment.pk).update(
+                path=paths[comment.pk]
+            )
+        prefixes = paths
+        level = comments.filter(parent_id__in=paths.keys())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
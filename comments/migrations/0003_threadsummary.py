@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-19 14:51
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+import django.db.models.deletion
+
+
+def fill_summaries(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    ThreadSummary = apps.get_model('comments', 'ThreadSummary')
+    db = schema_editor.connection.alias
+    threads = {}
+    roots = Comment.objects.using(db).filter(
+        parent__isnull=True, owner_id__isnull=False,
+        owner_type_id__isnull=False
+    ).values_list('owner_type_id', 'owner_id', 'path')
+    for owner_type_id, owner_id, path in roots:
+        threads.setdefault((owner_type_id, owner_id), []).append(path)
+
+    for (owner_type_id, owner_id), paths in threads.items():
+        count, last, users = 0, None, set()
+        for path in paths:
+            qs = Comment.objects.using(db).filter(
+                path__gte=path, path__lt=path[:-1] + '0'
+            )
+            stats = qs.aggregate(count=Count('id'), last=Max('create_at'))
+            count += stats['count']
+            if last is None or stats['last'] > last:
+                last = stats['last']
+            users.update(qs.filter(user__isnull=False)
+                         .values_list('user_id', flat=True))
+        ThreadSummary.objects.using(db).create(
+            owner_type_id=owner_type_id, owner_id=owner_id,
+            comment_count=count, participant_count=len(users),
+            last_comment_at=last
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('comments', '0002_comment_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner_id', models.PositiveIntegerField()),
+                ('comment_count', models.PositiveIntegerField(default=0)),
+                ('participant_count', models.PositiveIntegerField(default=0)),
+                ('last_comment_at', models.DateTimeField(blank=True, null=True)),
+                ('owner_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='threadsummary',
+            unique_together=set([('owner_type', 'owner_id')]),
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-19 14:52
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def create_fts(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        if 'ENABLE_FTS5' not in [x[0] for x in cursor.fetchall()]:
+            return
+        cursor.execute(
+            'CREATE VIRTUAL TABLE comments_comment_fts USING fts5(body)'
+        )
+        cursor.execute(
+            'INSERT INTO comments_comment_fts (rowid, body) '
+            'SELECT id, body FROM comments_comment'
+        )
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS comments_comment_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0003_threadsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
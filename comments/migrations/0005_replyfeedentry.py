@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-19 14:52
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_feed(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    ReplyFeedEntry = apps.get_model('comments', 'ReplyFeedEntry')
+    db = schema_editor.connection.alias
+    replies = Comment.objects.using(db).filter(
+        parent__isnull=False, parent__user__isnull=False
+    ).exclude(user=models.F('parent__user')).order_by('id')\
+        .values_list('id', 'parent__user_id')
+    ReplyFeedEntry.objects.using(db).bulk_create([
+        ReplyFeedEntry(comment_id=comment_id, user_id=user_id)
+        for comment_id, user_id in replies
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('comments', '0004_comment_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplyFeedEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('comment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='comments.Comment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='replyfeedentry',
+            index_together=set([('user', 'id')]),
+        ),
+        migrations.RunPython(fill_feed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-19 15:14
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_participants(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    ArchivedComment = apps.get_model('comments', 'ArchivedComment')
+    ThreadParticipant = apps.get_model('comments', 'ThreadParticipant')
+    db = schema_editor.connection.alias
+    participants = set()
+    roots = Comment.objects.using(db).filter(
+        parent__isnull=True, owner_id__isnull=False,
+        owner_type_id__isnull=False
+    ).values_list('owner_type_id', 'owner_id', 'path')
+    for owner_type_id, owner_id, path in roots:
+        users = Comment.objects.using(db).filter(
+            path__gte=path, path__lt=path[:-1] + '0', user__isnull=False
+        ).values_list('user_id', flat=True)
+        participants.update((owner_type_id, owner_id, x) for x in users)
+    participants.update(ArchivedComment.objects.using(db).filter(
+        thread__owner_id__isnull=False, thread__owner_type_id__isnull=False,
+        user__isnull=False
+    ).values_list('thread__owner_type_id', 'thread__owner_id', 'user_id'))
+    ThreadParticipant.objects.using(db).bulk_create([
+        ThreadParticipant(owner_type_id=x[0], owner_id=x[1], user_id=x[2])
+        for x in participants
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('comments', '0006_archivedthread'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadParticipant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner_id', models.PositiveIntegerField()),
+                ('owner_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='threadparticipant',
+            unique_together=set([('owner_type', 'owner_id', 'user')]),
+        ),
+        migrations.RunPython(fill_participants, migrations.RunPython.noop),
+    ]
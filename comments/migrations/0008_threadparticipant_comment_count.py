@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-19 15:35
+from __future__ import unicode_literals
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def fill_comment_counts(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    ArchivedComment = apps.get_model('comments', 'ArchivedComment')
+    ThreadParticipant = apps.get_model('comments', 'ThreadParticipant')
+    db = schema_editor.connection.alias
+    counts = Counter()
+    roots = Comment.objects.using(db).filter(
+        parent__isnull=True, owner_id__isnull=False,
+        owner_type_id__isnull=False
+    ).values_list('owner_type_id', 'owner_id', 'path')
+    for owner_type_id, owner_id, path in roots:
+        users = Comment.objects.using(db).filter(
+            path__gte=path, path__lt=path[:-1] + '0', user__isnull=False
+        ).values_list('user_id', flat=True)
+        counts.update((owner_type_id, owner_id, x) for x in users)
+    counts.update(ArchivedComment.objects.using(db).filter(
+        thread__owner_id__isnull=False, thread__owner_type_id__isnull=False,
+        user__isnull=False
+    ).values_list('thread__owner_type_id', 'thread__owner_id', 'user_id'))
+    for (owner_type_id, owner_id, user_id), count in counts.items():
+        ThreadParticipant.objects.using(db).filter(
+            owner_type_id=owner_type_id, owner_id=owner_id, user_id=user_id
+        ).update(comment_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0007_threadparticipant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='threadparticipant',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_comment_counts, migrations.RunPython.noop),
+    ]
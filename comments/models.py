@@ -1,13 +1,91 @@
 from __future__ import unicode_literals
 
 import json
+import zlib
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
 
+from django.core.exceptions import ValidationError
 from django.db import models, transaction
+from django.db.models import F, Q, Value, Count, Max
+from django.db.models.functions import Concat, Length, Substr
 from django.forms.models import model_to_dict
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
+from django.utils import six
+
+from . import settings as app_settings
+from .hotness import hot_threads
+from .loading import load
+from .routers import on_primary
+
+
+def resolve_owners(objects, field_name='owner'):
+    """
+    Fills the generic foreign key ``field_name`` of ``objects``, loading
+    the owners of every content type with a single ``in_bulk`` call.
+    """
+    objects = list(objects)
+    if not objects:
+        return objects
+    field = objects[0]._meta.get_field(field_name)
+    ct_attname = objects[0]._meta.get_field(field.ct_field).get_attname()
+    groups = defaultdict(set)
+    for obj in objects:
+        ct_id, pk = getattr(obj, ct_attname), getattr(obj, field.fk_field)
+        if ct_id is not None and pk is not None:
+            groups[ct_id].add(pk)
+
+    owners = {}
+    for ct_id, pks in groups.items():
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        owners[ct_id] = model._default_manager.in_bulk(list(pks))
+    for obj in objects:
+        owner = owners.get(getattr(obj, ct_attname), {})\
+            .get(getattr(obj, field.fk_field))
+        if owner is not None:
+            setattr(obj, field.cache_attr, owner)
+    return objects
+
+
+def owner_summary(owner):
+    if owner is None:
+        return None
+    return {
+        'type': owner._meta.label_lower,
+        'id': owner.pk,
+        'title': six.text_type(owner)
+    }
+
+
+class OwnerQuerySet(models.QuerySet):
+    """
+    QuerySet able to resolve the generic ``owner`` of its results in bulk.
+    """
+    _with_owners = False
+
+    def with_owners(self):
+        clone = self._clone()
+        clone._with_owners = True
+        return clone
+
+    def _clone(self, **kwargs):
+        clone = super(OwnerQuerySet, self)._clone(**kwargs)
+        clone._with_owners = self._with_owners
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super(OwnerQuerySet, self)._fetch_all()
+        if fetched and self._with_owners:
+            resolve_owners(
+                x for x in self._result_cache
+                if isinstance(x, self.model)
+            )
 
 
 class AbstractTestEntity(models.Model):
@@ -28,6 +106,83 @@ class Photo(AbstractTestEntity):
     pass
 
 
+# Every level of ``Comment.path`` is the zero-padded primary key followed by
+# a separator, so ordering by path gives depth-first thread order.
+PATH_DIGITS = 10
+PATH_SEPARATOR = '/'
+PATH_STEP = PATH_DIGITS + len(PATH_SEPARATOR)
+PATH_MAX_LENGTH = 255
+# Levels a thread can hold, deeper replies and moves are rejected
+MAX_DEPTH = PATH_MAX_LENGTH // PATH_STEP
+
+
+def path_segment(pk):
+    return '{:0{}d}{}'.format(pk, PATH_DIGITS, PATH_SEPARATOR)
+
+
+def path_range(prefix):
+    """
+    Returns lookup kwargs matching every path under ``prefix``.
+
+    A plain ``gte``/``lt`` pair is used instead of ``startswith`` so the
+    lookup is an index range scan on every backend.
+    """
+    return {
+        'path__gte': prefix,
+        'path__lt': prefix[:-1] + chr(ord(PATH_SEPARATOR) + 1)
+    }
+
+
+def trees_to_dict(comments, chunk_size=400, with_owner=False,
+                  max_depth=None):
+    """
+    Serializes ``comments`` with their whole subtrees, fetching the
+    descendants of up to ``chunk_size`` comments in a single query.
+
+    ``max_depth`` limits the levels returned below each comment, either
+    one value for all comments or a dict keyed by comment id.
+    """
+    result = []
+    for comment in comments:
+        dict_obj = comment.to_dict(False, with_owner)
+        dict_obj['childs'] = []
+        result.append((comment, {comment.pk: dict_obj}))
+
+    for i in range(0, len(result), chunk_size):
+        chunk = result[i:i + chunk_size]
+        roots, ranges = {}, []
+        for comment, nodes in chunk:
+            depth = max_depth
+            if isinstance(max_depth, dict):
+                depth = max_depth.get(comment.pk)
+            limit = None
+            if depth is not None:
+                limit = len(comment.path) + depth * PATH_STEP
+            roots[comment.pk] = (comment, nodes, limit)
+            q = Q(**path_range(comment.path))
+            if limit is not None:
+                q &= Q(path_length__lte=limit)
+            ranges.append(q)
+        descendants = Comment.objects.annotate(path_length=Length('path'))\
+            .filter(reduce(or_, ranges)).order_by('path')
+        # Descendants come in path order, so a parent is always seen
+        # before its children. A comment is added to the tree of every
+        # requested ancestor, requested comments may be nested.
+        for comment in descendants:
+            node = None
+            for pk in comment.ancestor_ids():
+                if pk not in roots:
+                    continue
+                _, nodes, limit = roots[pk]
+                if limit is not None and len(comment.path) > limit:
+                    continue
+                if node is None:
+                    node = comment.to_dict(False)
+                nodes[comment.pk] = dict(node, childs=[])
+                nodes[comment.parent_id]['childs'].append(nodes[comment.pk])
+    return [nodes[comment.pk] for comment, nodes in result]
+
+
 class Comment(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True)
     parent = models.ForeignKey(
@@ -43,9 +198,121 @@ class Comment(models.Model):
 
     body = models.TextField()
 
+    path = models.CharField(
+        max_length=PATH_MAX_LENGTH, db_index=True, blank=True, default='',
+        editable=False
+    )
+
+    objects = OwnerQuerySet.as_manager()
+
     class Meta:
         ordering = ['create_at']
 
+    @property
+    def depth(self):
+        return max(len(self.path) // PATH_STEP - 1, 0)
+
+    @property
+    def root_id(self):
+        if not self.path:
+            return None
+        return int(self.path[:PATH_DIGITS])
+
+    def ancestor_ids(self):
+        return [
+            int(self.path[i:i + PATH_DIGITS])
+            for i in range(0, len(self.path) - PATH_STEP, PATH_STEP)
+        ]
+
+    def get_descendants(self):
+        return Comment.objects.filter(**path_range(self.path))\
+            .exclude(pk=self.pk).order_by('path')
+
+    def get_thread_window(self, limit=10):
+        """
+        Returns up to ``limit`` comments that follow this one in
+        depth-first order of its thread.
+        """
+        thread = path_range(self.path[:PATH_STEP])
+        return Comment.objects.filter(
+            path__gt=self.path, path__lt=thread['path__lt']
+        ).order_by('path')[:limit]
+
+    def get_thread_owner(self):
+        """
+        Returns ``(owner_type_id, owner_id)`` of the entity the thread of
+        this comment belongs to, or None.
+        """
+        if self.parent_id is None:
+            owner = (self.owner_type_id, self.owner_id)
+        else:
+            owner = Comment.objects.filter(pk=self.root_id)\
+                .values_list('owner_type_id', 'owner_id').first()
+        if owner is None or None in owner:
+            return None
+        return owner
+
+    def subtree_stats(self):
+        """
+        Returns the comment count per user (``None`` for anonymous ones)
+        and the last comment time of the subtree of this comment.
+        """
+        users, last = Counter(), None
+        rows = Comment.objects.filter(**path_range(self.path)).order_by()\
+            .values('user_id').annotate(count=Count('id'),
+                                        last=Max('create_at'))
+        for row in rows:
+            users[row['user_id']] += row['count']
+            if last is None or row['last'] > last:
+                last = row['last']
+        return users, last
+
+    def check_depth(self, path=None):
+        """
+        Raises ValidationError when the comment and its subtree would not
+        fit ``MAX_DEPTH`` levels under the parent. ``path`` is the stored
+        path of a comment being moved, None for a new one.
+        """
+        if not self.parent_id:
+            return
+        parent_path = Comment.objects.filter(pk=self.parent_id)\
+            .values_list('path', flat=True).first()
+        if parent_path is None:
+            return
+        levels = 1
+        if path:
+            longest = Comment.objects.filter(**path_range(path))\
+                .aggregate(length=Max(Length('path')))['length']
+            levels = (longest - len(path)) // PATH_STEP + 1
+        if len(parent_path) // PATH_STEP + levels > MAX_DEPTH:
+            raise ValidationError({'parent': (
+                'Threads hold at most {} levels of comments'.format(MAX_DEPTH)
+            )})
+
+    def clean(self):
+        path = None
+        if self.pk:
+            parent_id, path = Comment.objects.filter(pk=self.pk)\
+                .values_list('parent_id', 'path').get()
+            if parent_id == self.parent_id:
+                return
+        self.check_depth(path)
+
+    def build_path(self):
+        prefix = ''
+        if self.parent_id:
+            prefix = Comment.objects.filter(pk=self.parent_id)\
+                .values_list('path', flat=True).get()
+        return prefix + path_segment(self.pk)
+
+    def move_descendants(self, old_path):
+        Comment.objects.filter(**path_range(old_path))\
+            .exclude(pk=self.pk)\
+            .update(path=Concat(
+                Value(self.path), Substr('path', len(old_path) + 1),
+                output_field=models.CharField()
+            ))
+
     def delete_links(self):
         CommentClosure.objects.filter(
             child=self, parent=self.parent
@@ -72,7 +339,9 @@ class Comment(models.Model):
     def get_absolute_url(self):
         return reverse('comment_detail', kwargs={'pk': self.pk})
 
-    def to_dict(self, with_childs=True):
+    def to_dict(self, with_childs=True, with_owner=False):
+        if with_childs:
+            return trees_to_dict([self], with_owner=with_owner)[0]
         dict_obj = model_to_dict(self, fields=(
             'id', 'user', 'parent', 'owner_type', 'owner_id',
             'body'
@@ -81,19 +350,20 @@ class Comment(models.Model):
             'create_at': self.create_at.isoformat(),
             'update_at': self.update_at.isoformat()
         })
-        if with_childs:
-            dict_obj['childs'] = map(
-                lambda x: x.child.to_dict(),
-                self.childrens.filter(child__parent=self)
-            )
+        if with_owner:
+            dict_obj['owner'] = owner_summary(self.owner)
         return dict_obj
 
+    @on_primary
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
         create = self.pk is None
         if create:
+            self.check_depth()
             super(Comment, self).save(force_insert, force_update, using,
                                       update_fields)
+            self.path = self.build_path()
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
             closure_instance = CommentClosure(
                 parent=self,
                 child=self,
@@ -102,9 +372,15 @@ class Comment(models.Model):
             closure_instance.save()
             self.create_links()
 
+            ThreadSummary.comment_created(self)
+            ReplyFeedEntry.comment_created(self)
+
+            from .search import index_comment
+            index_comment(self)
+            hot_threads.record_write(self.root_id)
+
             # Send notifications
-            from .utils import NotifyTask
-            task = NotifyTask(self)
+            task = load(app_settings.NOTIFY_TASK)(self)
             task.run()
         else:
             orig = Comment.objects.get(pk=self.pk)
@@ -113,19 +389,47 @@ class Comment(models.Model):
                 comment=orig
             )
             history.save()
+            self.path = orig.path
             if orig.parent_id != self.parent_id:
+                self.check_depth(orig.path)
                 orig.delete_links()
                 self.create_links()
+                self.path = self.build_path()
+                self.move_descendants(orig.path)
             super(Comment, self).save(force_insert, force_update, using,
                                       update_fields)
-
+            if orig.body != self.body:
+                from .search import index_comment
+                index_comment(self)
+            for root_id in {orig.root_id, self.root_id}:
+                hot_threads.record_write(root_id)
+
+            # Moves between entities change the summaries of both
+            owner, orig_owner = self.get_thread_owner(), \
+                orig.get_thread_owner()
+            if owner != orig_owner:
+                users, last = self.subtree_stats()
+                if orig_owner:
+                    ThreadSummary.comments_removed(orig_owner, users, last)
+                if owner:
+                    ThreadSummary.comments_added(owner, users, last)
+
+    @on_primary
     def delete(self, using=None, keep_parents=False):
         with transaction.atomic():
+            owner = self.get_thread_owner()
+            users, last = self.subtree_stats()
+            from .search import unindex_comments
+            unindex_comments(Comment.objects.filter(**path_range(self.path))
+                             .values_list('pk', flat=True))
             childs = Comment.objects.filter(parents__parent=self)
             closures = CommentClosure.objects.filter(parent=self)
             closures.delete()
             map(lambda x: x.delete(), childs)
             super(Comment, self).delete(using, keep_parents)
+            if owner:
+                ThreadSummary.comments_removed(owner, users, last)
+            hot_threads.record_write(self.root_id)
 
 
 
@@ -155,6 +459,8 @@ class AsyncCommentsDump(models.Model):
     start_at = models.DateTimeField(blank=True, null=True)
     end_at = models.DateTimeField(blank=True, null=True)
 
+    objects = OwnerQuerySet.as_manager()
+
     def is_ready(self):
         return self.path is not None
 
@@ -165,4 +471,313 @@ class AsyncCommentsDump(models.Model):
             exclude=('path',)
         )
         dict_obj['path'] = self.path.url
+        dict_obj['owner'] = owner_summary(self.owner)
+        return dict_obj
+
+
+def owner_threads(owner_type_id, owner_id, chunk_size=400):
+    """
+    Yields filters matching every comment in the threads of an entity,
+    covering the threads of up to ``chunk_size`` roots each.
+    """
+    paths = list(Comment.objects.filter(
+        owner_type_id=owner_type_id, owner_id=owner_id,
+        parent__isnull=True
+    ).values_list('path', flat=True))
+    for i in range(0, len(paths), chunk_size):
+        yield reduce(or_, [
+            Q(**path_range(path)) for path in paths[i:i + chunk_size]
+        ])
+
+
+def last_comment_time(owner_type_id, owner_id):
+    """
+    Returns the time of the last comment in the threads of an entity,
+    archived ones included.
+    """
+    times = [
+        Comment.objects.filter(q).aggregate(last=Max('create_at'))['last']
+        for q in owner_threads(owner_type_id, owner_id)
+    ]
+    times.append(ArchivedThread.objects.filter(
+        owner_type_id=owner_type_id, owner_id=owner_id
+    ).aggregate(last=Max('last_comment_at'))['last'])
+    times = [x for x in times if x is not None]
+    return max(times) if times else None
+
+
+class ThreadParticipant(models.Model):
+    """
+    User who commented in the threads of an entity, archived ones
+    included, with the number of their comments there. The unique row
+    makes counting new and leaving participants O(1).
+    """
+    owner_type = models.ForeignKey(ContentType)
+    owner_id = models.PositiveIntegerField()
+    owner = GenericForeignKey('owner_type', 'owner_id')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('owner_type', 'owner_id', 'user')
+
+    @classmethod
+    def add_comments(cls, owner, user_id, count):
+        """
+        Adds ``count`` comments of a user to the threads of ``owner`` and
+        returns whether the user is a new participant there.
+        """
+        participant, created = cls.objects.get_or_create(
+            owner_type_id=owner[0], owner_id=owner[1], user_id=user_id,
+            defaults={'comment_count': count}
+        )
+        if not created:
+            cls.objects.filter(pk=participant.pk).update(
+                comment_count=F('comment_count') + count
+            )
+        return created
+
+
+class ThreadSummary(models.Model):
+    """
+    Comment count, participant count and last comment time of all threads
+    of an entity, archived ones included. Updated incrementally when
+    comments are created, deleted or moved between entities.
+    """
+    owner_type = models.ForeignKey(ContentType)
+    owner_id = models.PositiveIntegerField()
+    owner = GenericForeignKey('owner_type', 'owner_id')
+    comment_count = models.PositiveIntegerField(default=0)
+    participant_count = models.PositiveIntegerField(default=0)
+    last_comment_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('owner_type', 'owner_id')
+
+    @classmethod
+    def comment_created(cls, comment):
+        owner = comment.get_thread_owner()
+        if owner is None:
+            return
+        summary, _ = cls.objects.get_or_create(
+            owner_type_id=owner[0], owner_id=owner[1]
+        )
+        new_participant = comment.user_id is not None and \
+            ThreadParticipant.add_comments(owner, comment.user_id, 1)
+        cls.objects.filter(pk=summary.pk).update(
+            comment_count=F('comment_count') + 1,
+            participant_count=F('participant_count') + int(new_participant),
+            last_comment_at=comment.create_at
+        )
+
+    @classmethod
+    def comments_added(cls, owner, users, last_comment_at):
+        """
+        Adds a subtree moved into the threads of ``owner``: ``users`` counts
+        its comments per user, as returned by ``Comment.subtree_stats``.
+        """
+        summary, _ = cls.objects.get_or_create(
+            owner_type_id=owner[0], owner_id=owner[1]
+        )
+        new_participants = sum(
+            ThreadParticipant.add_comments(owner, user_id, count)
+            for user_id, count in users.items() if user_id is not None
+        )
+        cls.objects.filter(pk=summary.pk).update(
+            comment_count=F('comment_count') + sum(users.values()),
+            participant_count=F('participant_count') + new_participants
+        )
+        cls.objects.filter(pk=summary.pk).filter(
+            Q(last_comment_at__isnull=True) |
+            Q(last_comment_at__lt=last_comment_at)
+        ).update(last_comment_at=last_comment_at)
+
+    @classmethod
+    def comments_removed(cls, owner, users, last_comment_at):
+        """
+        Subtracts a subtree deleted from or moved out of the threads of
+        ``owner``. The last comment time is only looked up again when the
+        subtree held the latest comment.
+        """
+        participants = ThreadParticipant.objects.filter(
+            owner_type_id=owner[0], owner_id=owner[1]
+        )
+        for user_id, count in users.items():
+            if user_id is not None:
+                participants.filter(user_id=user_id).update(
+                    comment_count=F('comment_count') - count
+                )
+        left = participants.filter(
+            user_id__in=[x for x in users if x is not None], comment_count=0
+        ).delete()[0]
+        summaries = cls.objects.filter(owner_type_id=owner[0],
+                                       owner_id=owner[1])
+        summaries.update(
+            comment_count=F('comment_count') - sum(users.values()),
+            participant_count=F('participant_count') - left
+        )
+        if summaries.filter(last_comment_at__lte=last_comment_at).exists():
+            summaries.update(last_comment_at=last_comment_time(*owner))
+
+    @classmethod
+    def refresh(cls, owner_type_id, owner_id):
+        """
+        Recalculates the summary and participants of an entity from scratch.
+        """
+        users = Counter()
+        for q in owner_threads(owner_type_id, owner_id):
+            users.update(dict(
+                Comment.objects.filter(q).order_by().values_list('user_id')
+                .annotate(count=Count('id'))
+            ))
+        # Archived threads still count for their entity
+        users.update(dict(
+            ArchivedComment.objects.filter(
+                thread__owner_type_id=owner_type_id, thread__owner_id=owner_id
+            ).order_by().values_list('user_id').annotate(count=Count('id'))
+        ))
+        comment_count = sum(users.values())
+        users.pop(None, None)
+        ThreadParticipant.objects.filter(
+            owner_type_id=owner_type_id, owner_id=owner_id
+        ).delete()
+        ThreadParticipant.objects.bulk_create([
+            ThreadParticipant(owner_type_id=owner_type_id, owner_id=owner_id,
+                              user_id=user_id, comment_count=count)
+            for user_id, count in users.items()
+        ])
+        cls.objects.update_or_create(
+            owner_type_id=owner_type_id, owner_id=owner_id,
+            defaults={
+                'comment_count': comment_count,
+                'participant_count': len(users),
+                'last_comment_at': last_comment_time(owner_type_id, owner_id)
+            }
+        )
+
+    def as_dict(self):
+        return {
+            'owner_type': self.owner_type_id,
+            'owner_id': self.owner_id,
+            'comment_count': self.comment_count,
+            'participant_count': self.participant_count,
+            'last_comment_at': self.last_comment_at and
+            self.last_comment_at.isoformat()
+        }
+
+
+class ReplyFeedEntry(models.Model):
+    """
+    Timeline of replies to comments of a user, filled on write and capped
+    at ``COMMENTS_REPLY_FEED_LIMIT`` newest entries per user.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+    comment = models.ForeignKey(Comment)
+
+    class Meta:
+        index_together = ('user', 'id')
+
+    @classmethod
+    def comment_created(cls, comment):
+        if not comment.parent_id:
+            return
+        user_id = Comment.objects.filter(pk=comment.parent_id)\
+            .values_list('user_id', flat=True).get()
+        if user_id is None or user_id == comment.user_id:
+            return
+        cls.objects.create(user_id=user_id, comment=comment)
+        cls.trim(user_id)
+
+    @classmethod
+    def trim(cls, user_id):
+        """
+        Drops entries of a user beyond the newest ``REPLY_FEED_LIMIT``.
+        """
+        limit = app_settings.REPLY_FEED_LIMIT
+        cutoff = cls.objects.filter(user_id=user_id).order_by('-id')\
+            .values_list('id', flat=True)[limit:limit + 1]
+        if cutoff:
+            cls.objects.filter(user_id=user_id, id__lte=cutoff[0]).delete()
+
+
+class ArchivedThread(models.Model):
+    """
+    Thread moved out of the live tables, stored as one compressed JSON
+    document with its comments in path order and their history.
+    """
+    root_id = models.PositiveIntegerField(unique=True)
+    owner_type = models.ForeignKey(ContentType, blank=True, null=True)
+    owner_id = models.PositiveIntegerField(blank=True, null=True)
+    owner = GenericForeignKey('owner_type', 'owner_id')
+    comment_count = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField()
+    last_comment_at = models.DateTimeField()
+    last_activity_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    data = models.BinaryField()
+
+    objects = OwnerQuerySet.as_manager()
+
+    class Meta:
+        index_together = ('owner_type', 'owner_id')
+
+    @property
+    def payload(self):
+        if not hasattr(self, '_payload'):
+            self._payload = json.loads(
+                zlib.decompress(bytes(self.data)).decode('utf-8')
+            )
+        return self._payload
+
+    @payload.setter
+    def payload(self, value):
+        self._payload = value
+        self.data = zlib.compress(
+            json.dumps(value, cls=DjangoJSONEncoder).encode('utf-8')
+        )
+
+    def to_dict(self, comment_id=None, with_childs=True, with_owner=False,
+                max_depth=None):
+        """
+        Same shape as ``Comment.to_dict`` of an archived comment, the root
+        by default. ``max_depth`` limits the levels returned below it.
+        """
+        comment_id = comment_id or self.root_id
+        comments = self.payload['comments']
+        path = next(x['path'] for x in comments if x['id'] == comment_id)
+        limit = None
+        if max_depth is not None:
+            limit = len(path) + max_depth * PATH_STEP
+        nodes = {}
+        for row in comments:
+            if not row['path'].startswith(path) or \
+                    limit is not None and len(row['path']) > limit:
+                continue
+            node = {k: v for k, v in row.items() if k != 'path'}
+            if not with_childs:
+                nodes[row['id']] = node
+                break
+            node['childs'] = []
+            if row['id'] != comment_id:
+                nodes[row['parent']]['childs'].append(node)
+            nodes[row['id']] = node
+        dict_obj = nodes[comment_id]
+        if with_owner:
+            owner = None
+            key = (dict_obj['owner_type'], dict_obj['owner_id'])
+            if key == (self.owner_type_id, self.owner_id):
+                owner = self.owner
+            elif all(key):
+                owner = ContentType.objects.get_for_id(key[0]).model_class()\
+                    ._default_manager.filter(pk=key[1]).first()
+            dict_obj['owner'] = owner_summary(owner)
         return dict_obj
+
+
+class ArchivedComment(models.Model):
+    """
+    Index of archived comments: the comment id is the primary key.
+    """
+    id = models.PositiveIntegerField(primary_key=True)
+    thread = models.ForeignKey(ArchivedThread, related_name='comments')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function, division
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.core.cache import caches
+
+from . import settings as app_settings
+
+
+def take_tokens(states, limits, now):
+    """
+    Refills ``(tokens, updated_at)`` buckets and takes one token from each
+    of them, or from none when any is empty. ``limits`` holds the
+    ``(rate, burst)`` of every bucket. Returns the new states and seconds
+    to wait, zero when allowed.
+    """
+    refilled, wait = [], 0
+    for state, (rate, burst) in zip(states, limits):
+        tokens, updated_at = state or (burst, now)
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        refilled.append(tokens)
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) / rate)
+    if not wait:
+        refilled = [x - 1 for x in refilled]
+    return [(x, now) for x in refilled], wait
+
+
+class LocalBucketStore(object):
+    """
+    Buckets of the current process, the least recently used are dropped
+    after ``max_size`` keys.
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, keys, limits):
+        with self._lock:
+            states, wait = take_tokens(
+                [self._buckets.pop(x, None) for x in keys], limits,
+                time.time()
+            )
+            self._buckets.update(zip(keys, states))
+            while len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore(object):
+    """
+    Buckets kept in a Django cache, shared by processes using it. Reading
+    and writing the buckets are separate cache calls, processes taking a
+    token at the same moment may both get the last one, so the limit is
+    only approximate under contention.
+    """
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def take(self, keys, limits):
+        keys = ['comments:bucket:{}'.format(x) for x in keys]
+        cached = self.cache.get_many(keys)
+        states, wait = take_tokens(
+            [cached.get(x) for x in keys], limits, time.time()
+        )
+        self.cache.set_many(
+            dict(zip(keys, states)),
+            max(int(burst / rate) + 1 for rate, burst in limits)
+        )
+        return wait
+
+
+_store = {}
+
+
+def get_store():
+    alias = app_settings.RATE_LIMIT_STORE
+    if alias not in _store:
+        _store[alias] = LocalBucketStore() if alias == 'local' \
+            else CacheBucketStore(alias)
+    return _store[alias]
+
+
+def write_keys(request, cleaned_data, instance=None, root_id=None):
+    """
+    Returns bucket keys of a comment write by kind: user, ip and thread.
+    ``root_id`` gives the thread when it is not loaded, e.g. archived.
+    The user bucket only counts authenticated users, the user of the body
+    could be anybody and anonymous writes are held by the ip bucket.
+    """
+    keys = {'ip': request.META.get('REMOTE_ADDR')}
+    if getattr(request, 'user', None) and request.user.is_authenticated:
+        keys['user'] = request.user.pk
+
+    parent = cleaned_data.get('parent')
+    if root_id is not None:
+        keys['thread'] = root_id
+    elif instance is not None and instance.root_id:
+        keys['thread'] = instance.root_id
+    elif parent is not None:
+        keys['thread'] = parent.root_id
+    elif cleaned_data.get('owner_type') and cleaned_data.get('owner_id'):
+        keys['thread'] = 'owner:{}:{}'.format(
+            cleaned_data['owner_type'].pk, cleaned_data['owner_id']
+        )
+    return {k: v for k, v in keys.items() if v is not None}
+
+
+def throttle_write(request, cleaned_data, instance=None, root_id=None):
+    """
+    Takes a token from every configured bucket of the write, or from none
+    of them when one is empty. Returns seconds to wait before retrying, or
+    None when the write is allowed.
+    """
+    if not app_settings.RATE_LIMITS:
+        return None
+    keys, limits = [], []
+    for kind, value in sorted(write_keys(request, cleaned_data, instance,
+                                         root_id).items()):
+        if kind in app_settings.RATE_LIMITS:
+            keys.append('{}:{}'.format(kind, value))
+            limits.append(app_settings.RATE_LIMITS[kind])
+    if not keys:
+        return None
+    return get_store().take(keys, limits) or None
+
+
+class WriteAdmission(object):
+    """
+    Tracks a moving average of write latency and sheds writes while it is
+    above ``COMMENTS_ADMISSION_MAX_LATENCY_MS``. Without new writes the
+    average halves every ``COMMENTS_ADMISSION_RETRY_AFTER`` seconds, so
+    admission resumes after a pause however many writes were shed.
+    """
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.latency_ms = 0.0
+        self.updated_at = time.time()
+        self._lock = Lock()
+
+    def estimate(self, now=None):
+        """
+        Average latency decayed by the time since the last recorded write.
+        """
+        elapsed = max(0, (now or time.time()) - self.updated_at)
+        return self.latency_ms * \
+            0.5 ** (elapsed / app_settings.ADMISSION_RETRY_AFTER)
+
+    def record(self, latency_ms):
+        with self._lock:
+            now = time.time()
+            average = self.estimate(now)
+            self.latency_ms = average + self.alpha * (latency_ms - average)
+            self.updated_at = now
+
+    def admit(self):
+        """
+        Returns seconds to wait before retrying, or None to admit a write.
+        """
+        limit = app_settings.ADMISSION_MAX_LATENCY_MS
+        if limit is None or self.estimate() <= limit:
+            return None
+        return app_settings.ADMISSION_RETRY_AFTER
+
+    def run(self, func, *args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record((time.time() - start) * 1000)
+
+
+admission = WriteAdmission()
@@ -11,11 +11,15 @@ from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 
+from . import settings as app_settings
+
 
 class LimitOffsetForm(forms.Form):
     limit = forms.IntegerField(initial=10, required=False)
     offset = forms.IntegerField(initial=0, required=False)
     full_tree = forms.BooleanField(initial=False, required=False)
+    stream = forms.BooleanField(initial=False, required=False)
+    with_owner = forms.BooleanField(initial=False, required=False)
 
 
 class ListForm(LimitOffsetForm):
@@ -27,11 +31,97 @@ class ListForm(LimitOffsetForm):
     owner_id = forms.IntegerField(required=False)
 
 
-class DumpForm(forms.Form):
-    user = forms.ModelChoiceField(
-        queryset=get_user_model().objects.all(),
+class ThreadForm(forms.Form):
+    after = forms.IntegerField(required=False)
+    limit = forms.IntegerField(
+        initial=10, min_value=1, max_value=app_settings.PAGE_MAX_LIMIT,
+        required=False
+    )
+
+
+class FeedForm(forms.Form):
+    cursor = forms.IntegerField(required=False)
+    limit = forms.IntegerField(
+        initial=10, min_value=1, max_value=app_settings.PAGE_MAX_LIMIT,
+        required=False
+    )
+
+
+class SummaryForm(forms.Form):
+    owners = forms.CharField(
+        help_text='Comma separated <owner_type_id>:<owner_id> pairs.'
+    )
+
+    def clean_owners(self):
+        try:
+            owners = [
+                tuple(int(x) for x in pair.split(':'))
+                for pair in self.cleaned_data['owners'].split(',') if pair
+            ]
+        except ValueError:
+            raise forms.ValidationError('Enter <owner_type_id>:<owner_id> pairs')
+        if any(len(x) != 2 for x in owners):
+            raise forms.ValidationError('Enter <owner_type_id>:<owner_id> pairs')
+        if len(owners) > app_settings.SUMMARY_MAX_OWNERS:
+            raise forms.ValidationError(
+                'Ensure at most {} owners'.format(app_settings.SUMMARY_MAX_OWNERS)
+            )
+        return owners
+
+
+class SearchForm(forms.Form):
+    q = forms.CharField()
+    owner_type = forms.ModelChoiceField(
+        queryset=ContentType.objects.all(),
         required=False
     )
+    owner_id = forms.IntegerField(required=False)
+    user = forms.IntegerField(required=False)
+    date_from = forms.DateTimeField(required=False)
+    date_to = forms.DateTimeField(required=False)
+    cursor = forms.CharField(required=False)
+    limit = forms.IntegerField(
+        initial=10, min_value=1, max_value=app_settings.PAGE_MAX_LIMIT,
+        required=False
+    )
+
+    def clean(self):
+        cleaned_data = super(SearchForm, self).clean()
+        # Threads are looked up by their entity, a type alone matches too
+        # many of them
+        if bool(cleaned_data.get('owner_type')) != \
+                (cleaned_data.get('owner_id') is not None):
+            raise forms.ValidationError(
+                'Pass owner_type and owner_id together'
+            )
+        return cleaned_data
+
+
+class BatchItemForm(forms.Form):
+    id = forms.IntegerField()
+    full_tree = forms.BooleanField(initial=False, required=False)
+    max_depth = forms.IntegerField(min_value=0, required=False)
+
+
+class BatchForm(forms.Form):
+    items = forms.Field(
+        help_text='List of comment ids or {"id", "full_tree", "max_depth"} '
+                  'objects.'
+    )
+
+    def clean_items(self):
+        items = self.cleaned_data['items']
+        if not isinstance(items, list):
+            raise forms.ValidationError('Enter a list of items')
+        if len(items) > app_settings.BATCH_MAX_IDS:
+            raise forms.ValidationError(
+                'Ensure at most {} items'.format(app_settings.BATCH_MAX_IDS)
+            )
+        return [x if isinstance(x, dict) else {'id': x} for x in items]
+
+
+class DumpForm(forms.Form):
+    user = forms.ModelChoiceField(queryset=None, required=False)
     owner_type = forms.ModelChoiceField(
         queryset=ContentType.objects.all(),
         required=False
@@ -40,6 +130,10 @@ class DumpForm(forms.Form):
     create_at__gte = forms.DateTimeField(required=False)
     create_at__lte = forms.DateTimeField(required=False)
 
+    def __init__(self, *args, **kwargs):
+        super(DumpForm, self).__init__(*args, **kwargs)
+        self.fields['user'].queryset = get_user_model().objects.all()
+
     def clean(self):
         cleaned_data = super(DumpForm, self).clean()
         user = cleaned_data.get('user')
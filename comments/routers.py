@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+import random
+from contextlib import contextmanager
+from functools import wraps
+from threading import local
+
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import settings as app_settings
+
+STICKY_COOKIE = 'comments_primary'
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_state = local()
+
+
+def pin_primary(pinned=True):
+    """
+    Sends reads of the current thread to the primary, e.g. right after
+    a write so the client sees its own changes.
+    """
+    _state.pinned = pinned
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+@contextmanager
+def primary():
+    """
+    Pins reads of the current thread to the primary inside the block.
+    """
+    pinned = is_pinned()
+    pin_primary(True)
+    try:
+        yield
+    finally:
+        pin_primary(pinned)
+
+
+def on_primary(func):
+    """
+    Runs ``func`` with reads pinned to the primary. Writes read rows they
+    are about to change, those reads must not see a lagging replica.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with primary():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def current_replica():
+    """
+    Replica serving reads of the current thread. Picked once, so counts,
+    pages and trees of one request come from the same replica.
+    """
+    replica = getattr(_state, 'replica', None)
+    if replica not in app_settings.DB_REPLICAS:
+        replica = _state.replica = random.choice(app_settings.DB_REPLICAS)
+    return replica
+
+
+def reset_replica():
+    _state.replica = None
+
+
+def db_for_dump():
+    """
+    Database used by dump exports: ``COMMENTS_DB_DUMP_REPLICA`` or any
+    read replica.
+    """
+    if app_settings.DB_DUMP_REPLICA:
+        return app_settings.DB_DUMP_REPLICA
+    if app_settings.DB_REPLICAS:
+        return current_replica()
+    return app_settings.DB_PRIMARY
+
+
+class CommentsRouter(object):
+    """
+    Sends reads of the comments app to ``COMMENTS_DB_REPLICAS`` and
+    writes to ``COMMENTS_DB_PRIMARY``.
+    """
+    app_label = 'comments'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != self.app_label or \
+                not app_settings.DB_REPLICAS:
+            return None
+        if is_pinned():
+            return app_settings.DB_PRIMARY
+        return current_replica()
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != self.app_label:
+            return None
+        return app_settings.DB_PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = [app_settings.DB_PRIMARY] + list(app_settings.DB_REPLICAS)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class PrimaryStickinessMiddleware(object):
+    """
+    Pins reads to the primary during writes and, through a short-lived
+    cookie, for the requests following them (e.g. the redirect issued
+    by ``CommentListView.post``). Every request picks its replica anew.
+    """
+    def __init__(self, get_response):
+        if not app_settings.DB_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        unsafe = request.method in UNSAFE_METHODS
+        pin_primary(unsafe or STICKY_COOKIE in request.COOKIES)
+        reset_replica()
+        try:
+            response = self.get_response(request)
+        finally:
+            pin_primary(False)
+            reset_replica()
+        if unsafe and response.status_code < 400:
+            response.set_cookie(
+                STICKY_COOKIE, '1', max_age=app_settings.DB_STICKY_SECONDS
+            )
+        return response
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+import base64
+from functools import reduce
+from operator import or_
+
+from django.db import connection
+
+from .models import Comment, owner_threads
+
+FTS_TABLE = 'comments_comment_fts'
+SCORE = 'bm25({})'.format(FTS_TABLE)
+SNIPPET = "snippet({}, 0, '<b>', '</b>', '...', 12)".format(FTS_TABLE)
+
+_available = {}
+
+
+def fts_available():
+    """
+    Whether the FTS5 shadow table exists, it is only created on SQLite
+    builds with FTS5. The answer is cached per database until the next
+    ``migrate``.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    key = (connection.alias, connection.settings_dict['NAME'])
+    if key not in _available:
+        _available[key] = \
+            FTS_TABLE in connection.introspection.table_names()
+    return _available[key]
+
+
+def reset_fts_available(**kwargs):
+    """
+    ``post_migrate`` receiver forgetting cached ``fts_available`` answers,
+    migrations may have created or dropped the index.
+    """
+    _available.clear()
+
+
+def index_comment(comment):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [comment.pk]
+        )
+        cursor.execute(
+            'INSERT INTO {} (rowid, body) VALUES (%s, %s)'.format(FTS_TABLE),
+            [comment.pk, comment.body]
+        )
+
+
+def unindex_comments(ids):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE),
+            [(x,) for x in ids]
+        )
+
+
+def rebuild_index():
+    """
+    Refills the index from the comments table, returns indexed rows.
+    """
+    if not fts_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+        cursor.execute(
+            'INSERT INTO {} (rowid, body) SELECT id, body FROM {}'.format(
+                FTS_TABLE, Comment._meta.db_table
+            )
+        )
+        return cursor.rowcount
+
+
+def match_expression(query):
+    # Every word is quoted so user input never hits the FTS5 syntax.
+    return ' '.join(
+        '"{}"'.format(word.replace('"', '""')) for word in query.split()
+    )
+
+
+def encode_cursor(score, pk):
+    return base64.urlsafe_b64encode('{!r}:{}'.format(score, pk).encode())\
+        .decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns ``(score, pk)`` of the last result of the previous page.
+    """
+    score, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+    return float(score), int(pk)
+
+
+def search(query, owner_type_id=None, owner_id=None, user_id=None,
+           date_from=None, date_to=None, cursor=None, limit=10):
+    """
+    Returns a page of comments matching ``query`` ranked by relevance and
+    the cursor of the next page. Without FTS5 falls back to a ``LIKE``
+    scan ordered by id.
+    """
+    qs = Comment.objects.all()
+    if owner_type_id and owner_id:
+        threads = list(owner_threads(owner_type_id, owner_id))
+        if not threads:
+            return [], None
+        qs = qs.filter(reduce(or_, threads))
+    if user_id:
+        qs = qs.filter(user_id=user_id)
+    if date_from:
+        qs = qs.filter(create_at__gte=date_from)
+    if date_to:
+        qs = qs.filter(create_at__lte=date_to)
+
+    if fts_available():
+        where = [
+            '{}.rowid = {}.id'.format(FTS_TABLE, Comment._meta.db_table),
+            '{} MATCH %s'.format(FTS_TABLE),
+        ]
+        params = [match_expression(query)]
+        if cursor:
+            score, pk = decode_cursor(cursor)
+            where.append('({0} > %s OR ({0} = %s AND {1}.id > %s))'.format(
+                SCORE, Comment._meta.db_table
+            ))
+            params.extend([score, score, pk])
+        qs = qs.extra(
+            select={'score': SCORE, 'snippet': SNIPPET},
+            tables=[FTS_TABLE], where=where, params=params,
+            order_by=['score', 'id']
+        )
+    else:
+        qs = qs.filter(body__icontains=query).order_by('id')
+        if cursor:
+            qs = qs.filter(pk__gt=decode_cursor(cursor)[1])
+
+    comments = list(qs[:limit + 1])
+    results = []
+    for comment in comments[:limit]:
+        dict_obj = comment.to_dict(False)
+        dict_obj['snippet'] = getattr(comment, 'snippet', None)
+        results.append(dict_obj)
+    next_cursor = None
+    if len(comments) > limit:
+        last = comments[limit - 1]
+        next_cursor = encode_cursor(getattr(last, 'score', 0.0), last.pk)
+    return results, next_cursor
@@ -9,8 +9,65 @@ __date__ = "11.12.16"
 
 from django.conf import settings
 
-from .backends import XMLDump
-
+# Dotted paths (or classes) resolved on first use, see comments.loading.
 DUMP_BACKENDS = getattr(settings, 'DUMP_BACKENDS', [
-    XMLDump
+    'comments.backends.XMLDump'
 ])
+DUMP_TASK = getattr(settings, 'COMMENTS_DUMP_TASK',
+                    'comments.utils.CreateCommentList')
+NOTIFY_TASK = getattr(settings, 'COMMENTS_NOTIFY_TASK',
+                      'comments.utils.NotifyTask')
+
+# Largest page the thread, replies feed and search endpoints return.
+PAGE_MAX_LIMIT = getattr(settings, 'COMMENTS_PAGE_MAX_LIMIT', 100)
+
+# Per-request query and timing instrumentation, see comments.middleware.
+METRICS_ENABLED = getattr(settings, 'COMMENTS_METRICS_ENABLED', False)
+METRICS_SLOW_MS = getattr(settings, 'COMMENTS_METRICS_SLOW_MS', 500)
+METRICS_SLOW_QUERIES = getattr(settings, 'COMMENTS_METRICS_SLOW_QUERIES', 50)
+METRICS_SAMPLE_RATE = getattr(settings, 'COMMENTS_METRICS_SAMPLE_RATE', 0.1)
+
+# SQLite tuning, see comments.sqlite.
+SQLITE_PRAGMAS = getattr(settings, 'COMMENTS_SQLITE_PRAGMAS', {})
+SQLITE_LOCK_RETRIES = getattr(settings, 'COMMENTS_SQLITE_LOCK_RETRIES', 2)
+
+# Database routing, see comments.routers.
+DB_PRIMARY = getattr(settings, 'COMMENTS_DB_PRIMARY', 'default')
+DB_REPLICAS = getattr(settings, 'COMMENTS_DB_REPLICAS', [])
+DB_DUMP_REPLICA = getattr(settings, 'COMMENTS_DB_DUMP_REPLICA', None)
+DB_STICKY_SECONDS = getattr(settings, 'COMMENTS_DB_STICKY_SECONDS', 5)
+
+# Cached subscriber index, see comments.subscribers.
+SUBSCRIBERS_CACHE = getattr(settings, 'COMMENTS_SUBSCRIBERS_CACHE', 'default')
+SUBSCRIBERS_TIMEOUT = getattr(settings, 'COMMENTS_SUBSCRIBERS_TIMEOUT', 3600)
+
+# Max entities per request to the thread summary endpoint.
+SUMMARY_MAX_OWNERS = getattr(settings, 'COMMENTS_SUMMARY_MAX_OWNERS', 100)
+
+# Entries kept per user in the replies feed, see comments.models.ReplyFeedEntry.
+REPLY_FEED_LIMIT = getattr(settings, 'COMMENTS_REPLY_FEED_LIMIT', 1000)
+
+# Token buckets for comment writes, e.g. {'user': (0.2, 5)} allows a user
+# 5 writes at once and one more every 5 seconds. Keys: user, ip, thread.
+RATE_LIMITS = getattr(settings, 'COMMENTS_RATE_LIMITS', {})
+# 'local' for an in-process store or the name of a cache from CACHES.
+RATE_LIMIT_STORE = getattr(settings, 'COMMENTS_RATE_LIMIT_STORE', 'local')
+# Writes are shed while their average latency is above this value.
+ADMISSION_MAX_LATENCY_MS = getattr(
+    settings, 'COMMENTS_ADMISSION_MAX_LATENCY_MS', None
+)
+ADMISSION_RETRY_AFTER = getattr(settings, 'COMMENTS_ADMISSION_RETRY_AFTER', 1)
+
+# Hot thread detection, see comments.hotness.
+HOT_THREADS_CAPACITY = getattr(settings, 'COMMENTS_HOT_THREADS_CAPACITY', 100)
+HOT_READ_THRESHOLD = getattr(settings, 'COMMENTS_HOT_READ_THRESHOLD', 100)
+HOT_WRITE_THRESHOLD = getattr(settings, 'COMMENTS_HOT_WRITE_THRESHOLD', 20)
+HOT_DECAY_SECONDS = getattr(settings, 'COMMENTS_HOT_DECAY_SECONDS', 60)
+HOT_CACHE = getattr(settings, 'COMMENTS_HOT_CACHE', 'default')
+HOT_CACHE_TIMEOUT = getattr(settings, 'COMMENTS_HOT_CACHE_TIMEOUT', 300)
+
+# Bulk read, see comments.views.CommentBatchView.
+BATCH_MAX_IDS = getattr(settings, 'COMMENTS_BATCH_MAX_IDS', 100)
+
+# Archival of inactive threads, see comments.archive.
+ARCHIVE_AFTER_DAYS = getattr(settings, 'COMMENTS_ARCHIVE_AFTER_DAYS', 365)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+import time
+from functools import wraps
+
+from django.db import connection, transaction, OperationalError
+from django.utils import six
+
+from . import settings as app_settings
+from .routers import primary
+
+def apply_pragmas(sender, connection, **kwargs):
+    """
+    ``connection_created`` receiver applying ``COMMENTS_SQLITE_PRAGMAS``.
+    """
+    if connection.vendor != 'sqlite' or not app_settings.SQLITE_PRAGMAS:
+        return
+    cursor = connection.cursor()
+    for name, value in sorted(app_settings.SQLITE_PRAGMAS.items()):
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def is_locked_error(exc):
+    return 'locked' in six.text_type(exc) or 'busy' in six.text_type(exc)
+
+
+def retry_on_locked(func=None, retries=None, delay=0.05):
+    """
+    Retries ``func`` with exponential backoff while SQLite reports the
+    database as locked. Only wrap statements that are safe to repeat.
+    """
+    if func is None:
+        return lambda f: retry_on_locked(f, retries, delay)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        attempts = app_settings.SQLITE_LOCK_RETRIES if retries is None \
+            else retries
+        for attempt in range(attempts + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if attempt == attempts or not is_locked_error(e):
+                    raise
+                time.sleep(delay * 2 ** attempt)
+    return wrapper
+
+
+@retry_on_locked
+def reserve_write_lock():
+    """
+    Takes the SQLite write lock at the start of a transaction so the
+    following statements do not hit busy errors halfway through.
+    """
+    # In-memory databases are private to a connection, nothing to lock.
+    if connection.vendor == 'sqlite' and \
+            not connection.is_in_memory_db(connection.settings_dict['NAME']):
+        from .models import Comment
+        connection.cursor().execute(
+            'UPDATE {} SET id = id WHERE 0'.format(Comment._meta.db_table)
+        )
+
+
+def submit_write(func, *args, **kwargs):
+    """
+    Runs a write in a transaction that takes the write lock first, with
+    ``COMMENTS_SQLITE_LOCK_RETRIES`` retries. Every attempt waits up to
+    ``OPTIONS['timeout']`` seconds for the lock, size both together.
+    """
+    with transaction.atomic(), primary():
+        reserve_write_lock()
+        return func(*args, **kwargs)
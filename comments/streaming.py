@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+from functools import reduce
+from operator import or_
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .compact import CompactTree
+from .models import Comment, path_range
+
+encoder = DjangoJSONEncoder()
+
+
+class Streamed(object):
+    """
+    JSON value that is already encoded as an iterable of string chunks.
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+def iter_json(data):
+    """
+    Encodes ``data`` chunk by chunk, expanding ``Streamed`` values lazily.
+    """
+    if isinstance(data, Streamed):
+        for chunk in data:
+            yield chunk
+    elif isinstance(data, dict):
+        yield '{'
+        for i, (key, value) in enumerate(data.items()):
+            yield '{}{}: '.format(', ' if i else '', encoder.encode(key))
+            for chunk in iter_json(value):
+                yield chunk
+        yield '}'
+    else:
+        yield encoder.encode(data)
+
+
+def _iter_list(items):
+    yield '['
+    for i, item in enumerate(items):
+        if i:
+            yield ', '
+        for chunk in iter_json(item):
+            yield chunk
+    yield ']'
+
+
+def streamed_list(items):
+    return Streamed(_iter_list(items))
+
+
+def _iter_tree(root, with_owner):
+    depths = []
+    opened = True
+    tree = CompactTree.from_comment(root)
+    for index, comment in tree.comments():
+        if index == 0:
+            comment = root
+        depth = tree.depth[index]
+        while depths and depths[-1] >= depth:
+            depths.pop()
+            opened = False
+            yield ']}'
+        if not opened:
+            yield ', '
+        node = encoder.encode(
+            comment.to_dict(False, with_owner and comment is root)
+        )
+        yield node[:-1] + ', "childs": ['
+        depths.append(depth)
+        opened = True
+    yield ']}' * len(depths)
+
+
+def streamed_tree(root, with_owner=False):
+    """
+    Encodes ``root`` with its subtree the way ``Comment.to_dict`` does.
+    The tree shape is read into a ``CompactTree`` first, comments are
+    then loaded in chunks, so large threads never sit in memory as rows.
+    """
+    return Streamed(_iter_tree(root, with_owner))
+
+
+def _iter_forest(roots, with_owner, before):
+    yield '['
+    for i, item in enumerate(before):
+        if i:
+            yield ', '
+        for chunk in iter_json(item):
+            yield chunk
+    if not roots:
+        yield ']'
+        return
+    by_pk = {x.pk: x for x in roots}
+    paths = [x.path for x in roots]
+    comments = Comment.objects.filter(
+        reduce(or_, [Q(**path_range(x)) for x in paths])
+    )
+    if paths == sorted(paths):
+        comments = comments.order_by('path')
+    else:
+        # Roots come by creation time, restored threads keep their old
+        # times and may not follow the path order
+        comments = comments.annotate(root_order=Case(*[
+            When(path__startswith=path, then=Value(i))
+            for i, path in enumerate(paths)
+        ], output_field=IntegerField())).order_by('root_order', 'path')
+
+    depths = []
+    # Whether the list or the childs of the last node were just opened
+    opened = not before
+    for comment in comments.iterator():
+        root = by_pk.get(comment.pk)
+        # A root closes the previous tree
+        depth = -1 if root is not None else len(comment.path)
+        while depths and depths[-1] >= depth:
+            depths.pop()
+            opened = False
+            yield ']}'
+        if not opened:
+            yield ', '
+        node = encoder.encode(root.to_dict(False, with_owner)
+                              if root is not None else comment.to_dict(False))
+        yield node[:-1] + ', "childs": ['
+        depths.append(len(comment.path))
+        opened = True
+    yield ']}' * len(depths) + ']'
+
+
+def streamed_trees(roots, with_owner=False, before=()):
+    """
+    Encodes a list of ``roots`` with their subtrees the way
+    ``trees_to_dict`` does, after the ready ``before`` items. All trees
+    come from one path range scan, a page costs one query however many
+    roots it has.
+    """
+    return Streamed(_iter_forest(roots, with_owner, before))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals, print_function
+
+__author__ = "Fedor Marchenko"
+__email__ = "mfs90@mail.ru"
+__date__ = "19.10.26"
+
+from array import array
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist
+
+from . import settings as app_settings
+
+
+def subscribers_key(content_type_id, object_id):
+    return 'comments:subscribers:{}:{}'.format(content_type_id, object_id)
+
+
+def _subscribers_field(model):
+    try:
+        return model._meta.get_field('subscribers')
+    except FieldDoesNotExist:
+        return None
+
+
+def get_subscriber_ids(content_type_id, object_id):
+    """
+    Returns a sorted ``array('l')`` of ids of users subscribed to the
+    entity, read from the cache and loaded from the M2M table on a miss.
+    """
+    cache = caches[app_settings.SUBSCRIBERS_CACHE]
+    key = subscribers_key(content_type_id, object_id)
+    ids = cache.get(key)
+    if ids is None:
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        field = _subscribers_field(model)
+        ids = array('l')
+        if field is not None:
+            ids.extend(sorted(
+                field.remote_field.through.objects.filter(**{
+                    '{}_id'.format(field.m2m_field_name()): object_id
+                }).values_list(
+                    '{}_id'.format(field.m2m_reverse_field_name()), flat=True
+                )
+            ))
+        cache.set(key, ids, app_settings.SUBSCRIBERS_TIMEOUT)
+    return ids
+
+
+def invalidate_subscribers(sender, instance, action, reverse, model, pk_set,
+                           **kwargs):
+    """
+    ``m2m_changed`` receiver dropping cached subscribers of the changed
+    entities once the rows are written, so a concurrent read cannot cache
+    the old subscribers again.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if reverse and pk_set is None:
+        # Clearing all subscriptions of a user, the entities are only
+        # known before their rows are deleted
+        cleared = instance.__dict__.setdefault('_cleared_subscriptions', {})
+        if action == 'pre_clear':
+            field = _subscribers_field(model)
+            cleared[sender] = list(sender.objects.filter(**{
+                '{}_id'.format(field.m2m_reverse_field_name()): instance.pk
+            }).values_list('{}_id'.format(field.m2m_field_name()), flat=True))
+            return
+        entity_model, pks = model, cleared.pop(sender, [])
+    elif action == 'pre_clear':
+        return
+    elif not reverse:
+        entity_model, pks = instance.__class__, [instance.pk]
+    else:
+        entity_model, pks = model, pk_set
+    ct = ContentType.objects.get_for_model(entity_model)
+    caches[app_settings.SUBSCRIBERS_CACHE].delete_many(
+        [subscribers_key(ct.pk, pk) for pk in pks]
+    )
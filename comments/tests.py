@@ -1,12 +1,53 @@
 import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from functools import wraps
 
-from django.test import TestCase, Client
-from django.test.utils import setup_test_environment
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed, ValidationError
+from django.core.management import call_command
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import OperationalError, connection, transaction
+from django.db.models.signals import m2m_changed
+from django.http import HttpResponse, HttpResponseRedirect
+from django.test import (
+    TestCase, TransactionTestCase, Client, RequestFactory
+)
+from django.test.utils import override_settings, setup_test_environment
+from django.utils import timezone
+from django.utils.six import StringIO
 from django.contrib.auth import get_user_model
 from django.urls.base import reverse
 from django.contrib.contenttypes.models import ContentType
 
-from .models import Comment, Post, Photo, HistoryComment
+from . import routers, search as search_module, settings as app_settings
+from .bench import (
+    BENCHMARKS, measure_import_time, seed_forest, slowest_imports,
+    run_benchmarks
+)
+from .compact import CompactTree
+from .hotness import SpaceSaving, check_hot_cache, hot_threads, render_tree
+from .metrics import registry
+from .middleware import QueryTimingMiddleware
+from .ratelimit import admission, get_store
+from .routers import (
+    CommentsRouter, PrimaryStickinessMiddleware, STICKY_COOKIE,
+    db_for_dump, is_pinned, pin_primary
+)
+from .search import fts_available, reset_fts_available
+from .sqlite import retry_on_locked
+from .subscribers import get_subscriber_ids
+from .utils import NotifyTask
+from .models import (
+    MAX_DEPTH, ArchivedThread, Comment, CommentClosure, Post, Photo,
+    HistoryComment, ReplyFeedEntry, ThreadParticipant, ThreadSummary
+)
 
 setup_test_environment()
 USER_MODEL = get_user_model()
@@ -168,6 +209,118 @@ class CommentsMethodsTests(TestCase):
             len(self.comments.keys()) - 1
         )
 
+    def test_streaming(self):
+        root = self.comments['1l_post']
+        for url in (
+            '{}?full_tree=1'.format(reverse('comment_list')),
+            '{}?offset=0'.format(reverse('comment_list')),
+            '{}?full_tree=1'.format(root.get_absolute_url()),
+        ):
+            response = self.client.get(url + '&stream=1')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            self.assertEqual(
+                json.loads(b''.join(response.streaming_content)),
+                json.loads(self.client.get(url).content)
+            )
+
+        # All trees of a list page come from one scan however many roots
+        Comment(owner=self.test_post, body='Another root').save()
+        url = '{}?full_tree=1&stream=1'.format(reverse('comment_list'))
+        response = self.client.get(url)
+        with self.assertNumQueries(1):
+            data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(
+            data, json.loads(self.client.get(url[:-9]).content)
+        )
+
+        # Roots out of the path order keep the order of the page
+        Comment.objects.filter(pk=root.pk).update(
+            create_at=timezone.now() + timedelta(days=1)
+        )
+        data = json.loads(b''.join(self.client.get(url).streaming_content))
+        self.assertEqual(data['object_list'][-1]['id'], root.pk)
+        self.assertEqual(
+            data, json.loads(self.client.get(url[:-9]).content)
+        )
+
+    def test_owner_resolution(self):
+        Comment(owner=self.test_photo, body='Second comment for Photo').save()
+        comments = list(
+            Comment.objects.filter(parent__isnull=True).with_owners()
+        )
+        with self.assertNumQueries(0):
+            owners = set((x.owner.__class__, x.owner.pk) for x in comments)
+        self.assertEqual(owners, {(Post, 1), (Photo, 2)})
+
+        response = self.client.get('{}?with_owner=1'.format(
+            reverse('comment_list')
+        ))
+        data = json.loads(response.content)
+        self.assertEqual(
+            data['object_list'][0]['owner'],
+            {'type': 'comments.post', 'id': 1, 'title': 'Post object'}
+        )
+
+    def test_thread_summary(self):
+        other_user = USER_MODEL.objects.create(username='other_user')
+        Comment(
+            parent=self.comments['3l_comment_comment'], body='Reply',
+            user=other_user
+        ).save()
+        url = '{}?owners={}:{},{}:{}'.format(
+            reverse('comments_summary'),
+            self.ct_post.pk, self.test_post.pk, self.ct_post.pk, 100
+        )
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        data = json.loads(response.content)['object_list']
+        self.assertEqual(data[0]['comment_count'], 4)
+        self.assertEqual(data[0]['participant_count'], 2)
+        self.assertEqual(data[1]['comment_count'], 0)
+
+        # Another comment of a known participant only adds to the count
+        Comment(
+            parent=self.comments['1l_post'], body='Again', user=other_user
+        ).save()
+        summary = ThreadSummary.objects.get(owner_id=self.test_post.pk)
+        self.assertEqual(summary.comment_count, 5)
+        self.assertEqual(summary.participant_count, 2)
+        self.assertEqual(ThreadParticipant.objects.filter(
+            owner_id=self.test_post.pk
+        ).count(), 2)
+
+        # Moving a subtree to the Photo thread updates both summaries
+        moved = self.comments['2l_post_comment']
+        moved.parent = self.comments['1l_photo']
+        moved.save()
+        summary = ThreadSummary.objects.get(owner_id=self.test_post.pk)
+        self.assertEqual(summary.comment_count, 2)
+        self.assertEqual(summary.participant_count, 2)
+        summary = ThreadSummary.objects.get(owner_id=self.test_photo.pk)
+        self.assertEqual(summary.comment_count, 5)
+        self.assertEqual(ThreadParticipant.objects.get(
+            owner_id=self.test_photo.pk, user=other_user
+        ).comment_count, 1)
+
+        # Deleting the only comment of a participant drops them
+        last_comment_at = ThreadSummary.objects.get(
+            owner_id=self.test_post.pk
+        ).last_comment_at
+        Comment.objects.get(body='Again').delete()
+        summary = ThreadSummary.objects.get(owner_id=self.test_post.pk)
+        self.assertEqual(summary.comment_count, 1)
+        self.assertEqual(summary.participant_count, 1)
+        self.assertLess(summary.last_comment_at, last_comment_at)
+        self.assertFalse(ThreadParticipant.objects.filter(
+            owner_id=self.test_post.pk, user=other_user
+        ).exists())
+
+        self.comments['1l_photo'].delete()
+        summary = ThreadSummary.objects.get(owner_id=self.test_photo.pk)
+        self.assertEqual(summary.comment_count, 0)
+        self.assertIsNone(summary.last_comment_at)
+
     def test_async_user_history(self):
         # Dump user comments history
         response = self.client.post(
@@ -188,3 +341,968 @@ class CommentsMethodsTests(TestCase):
             reverse('comments_dump'), self.test_user.pk
         ))
         self.assertEqual(response.status_code, 200)
+
+    def test_depth_limit(self):
+        parent = self.comments['1l_photo']
+        for _ in range(MAX_DEPTH - 1):
+            parent = Comment.objects.create(body='Deeper', parent=parent)
+        self.assertEqual(parent.depth, MAX_DEPTH - 1)
+        self.assertRaises(
+            ValidationError, Comment(body='Too deep', parent=parent).save
+        )
+        response = self.client.post(reverse('comment_list'), data=json.dumps({
+            'body': 'Too deep',
+            'user': self.test_user.pk,
+            'parent': parent.pk
+        }), content_type='application/json')
+        self.assertIn('parent', json.loads(response.content))
+
+        # A subtree moved under the deepest comment would not fit either
+        moved = self.comments['2l_post_comment']
+        moved.parent = parent.parent
+        self.assertRaises(ValidationError, moved.save)
+
+    def test_thread_order(self):
+        root = self.comments['1l_post']
+        # Getting thread of Post #1 in depth-first order
+        response = self.client.get(
+            reverse('comment_thread', args=(root.pk,))
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(
+            [(x['id'], x['depth']) for x in data['object_list']],
+            [(root.pk, 0),
+             (self.comments['2l_post_comment'].pk, 1),
+             (self.comments['3l_comment_comment'].pk, 2)]
+        )
+
+        # Window after the first reply
+        response = self.client.get('{}?after={}&limit=1'.format(
+            reverse('comment_thread', args=(root.pk,)),
+            self.comments['2l_post_comment'].pk
+        ))
+        data = json.loads(response.content)
+        self.assertEqual(
+            [x['id'] for x in data['object_list']],
+            [self.comments['3l_comment_comment'].pk]
+        )
+
+        # Bad limits are form errors
+        for limit in (-1, 0, app_settings.PAGE_MAX_LIMIT + 1):
+            response = self.client.get(
+                reverse('comment_thread', args=(root.pk,)), {'limit': limit}
+            )
+            self.assertIn('limit', json.loads(response.content))
+
+        # Moving a subtree rewrites the paths of its descendants
+        moved = self.comments['2l_post_comment']
+        moved.parent = self.comments['1l_photo']
+        moved.save()
+        leaf = Comment.objects.get(pk=self.comments['3l_comment_comment'].pk)
+        self.assertTrue(leaf.path.startswith(moved.path))
+        self.assertEqual(leaf.root_id, self.comments['1l_photo'].pk)
+        self.assertEqual(leaf.depth, 2)
+
+
+class BenchmarkTests(TestCase):
+    def test_run_benchmarks(self):
+        # Benchmark reads make threads hot, their trees outlive the test
+        self.addCleanup(cache.clear)
+        self.addCleanup(hot_threads.reset)
+        forest = seed_forest(posts=2, photos=1, users=3, roots=2, depth=2)
+        self.assertEqual(Comment.objects.count(), len(forest['comments']))
+
+        results = run_benchmarks(forest, repeat=2)
+        self.assertEqual(results.keys(), BENCHMARKS.keys())
+        for name, result in results.items():
+            self.assertEqual(result['runs'], 2)
+            # Metrics are served from memory
+            if name != 'metrics':
+                self.assertGreater(result['queries_max'], 0)
+
+    def test_import_time(self):
+        result = measure_import_time(repeat=1)
+        self.assertEqual(result['runs'], 1)
+        self.assertGreater(result['min_ms'], 0)
+        self.assertEqual(slowest_imports(
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        300 | comments.models\n'
+            'import time:        50 |         50 | django.db\n'
+        ), {'comments.models': 300})
+
+        # Notification and dump machinery is only loaded on first use
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, django; django.setup(); import comments.models; '
+            'print("comments.utils" in sys.modules, '
+            '"comments.backends" in sys.modules)'
+        ], env=dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE))
+        self.assertEqual(output.strip(), b'(False, False)'
+                         if sys.version_info[0] < 3 else b'False False')
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        app_settings.METRICS_ENABLED = True
+        registry.reset()
+        self.post = Post.objects.create()
+        root = Comment(owner=self.post, body='Root')
+        root.save()
+        Comment(parent=root, body='Reply').save()
+
+    def tearDown(self):
+        app_settings.METRICS_ENABLED = False
+
+    def test_disabled_by_default(self):
+        app_settings.METRICS_ENABLED = False
+        self.assertRaises(MiddlewareNotUsed, QueryTimingMiddleware, None)
+
+    def test_request_instrumentation(self):
+        handler = WSGIHandler()
+        middleware = QueryTimingMiddleware(handler._get_response)
+        request = RequestFactory().get(
+            '{}?full_tree=1'.format(reverse('comment_list'))
+        )
+        response = middleware(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('db;dur=', response['Server-Timing'])
+
+        stats = registry.snapshot()['comment_list']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['avg_tree_size'], 2)
+        self.assertGreater(stats['avg_queries'], 0)
+        # Cursor wrappers are removed once the request is done
+        self.assertNotIn('cursor', connection.__dict__)
+
+        response = self.client.get(reverse('comments_metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('comment_list', json.loads(response.content))
+
+
+class SQLiteWriteTests(TestCase):
+    def test_retry_on_locked(self):
+        calls = []
+
+        @retry_on_locked(retries=2, delay=0)
+        def locked():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return len(calls)
+
+        self.assertEqual(locked(), 3)
+
+    def test_concurrent_writers(self):
+        # The test database is in memory and private to each thread, the
+        # benchmark runs writer threads against a throwaway file database.
+        output = subprocess.check_output([
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'),
+            'bench_comments', '--only', 'list', '--repeat', '1',
+            '--posts', '2', '--photos', '1', '--write-load', '4',
+            '--writes', '10'
+        ], env=dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE))
+        write_load = json.loads(output)['write_load']
+        self.assertEqual(write_load['writes'], 40)
+        self.assertEqual(write_load['errors'], 0)
+        self.assertGreater(write_load['writes_per_sec'], 0)
+
+
+REPLICA_SETTINGS = """
+from {settings} import *
+
+DATABASES = {{
+    'default': dict(DATABASES['default'], NAME={primary!r}),
+    'replica': dict(DATABASES['default'], NAME={replica!r}),
+}}
+COMMENTS_DB_REPLICAS = ['replica']
+"""
+
+REPLICA_SCRIPT = """
+import json
+import django
+django.setup()
+from comments.models import Comment, CommentClosure, Post
+
+post = Post.objects.create()
+root = Comment(owner=post, body='root')
+root.save()
+child = Comment(owner=post, parent=root, body='child')
+child.save()
+reply = Comment(owner=post, parent=child, body='reply')
+reply.save()
+lagging = not Comment.objects.using('replica').filter(pk=root.pk).exists()
+path = reply.path.startswith(child.path) and child.path.startswith(root.path)
+closures = CommentClosure.objects.using('default').filter(child=reply).count()
+child.delete()
+left = Comment.objects.using('default').filter(owner_id=post.pk).count()
+print(json.dumps(
+    {'lagging': lagging, 'path': path, 'closures': closures, 'left': left}
+))
+"""
+
+
+class RouterTests(TestCase):
+    def setUp(self):
+        self.replicas = app_settings.DB_REPLICAS
+        app_settings.DB_REPLICAS = ['replica1', 'replica2']
+        self.router = CommentsRouter()
+
+    def tearDown(self):
+        app_settings.DB_REPLICAS = self.replicas
+        pin_primary(False)
+        routers.reset_replica()
+
+    def test_routing(self):
+        self.assertIn(
+            self.router.db_for_read(Comment), ['replica1', 'replica2']
+        )
+        self.assertIn(db_for_dump(), ['replica1', 'replica2'])
+        self.assertEqual(self.router.db_for_write(Comment), 'default')
+        self.assertIsNone(self.router.db_for_read(USER_MODEL))
+
+        pin_primary()
+        self.assertEqual(self.router.db_for_read(Comment), 'default')
+
+    def test_read_your_writes(self):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Comment))
+            return HttpResponseRedirect('/comments/1/')
+
+        middleware = PrimaryStickinessMiddleware(view)
+        factory = RequestFactory()
+        response = middleware(factory.post('/comments/'))
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertFalse(is_pinned())
+
+        # The redirect after the write still reads from the primary
+        request = factory.get('/comments/1/')
+        request.COOKIES[STICKY_COOKIE] = '1'
+        middleware(request)
+        middleware(factory.get('/comments/1/'))
+        self.assertEqual(reads[:2], ['default', 'default'])
+        self.assertIn(reads[2], ['replica1', 'replica2'])
+
+    def test_one_replica_per_request(self):
+        reads = []
+
+        def view(request):
+            reads.append([self.router.db_for_read(Comment)
+                          for _ in range(20)])
+            return HttpResponse()
+
+        middleware = PrimaryStickinessMiddleware(view)
+        for _ in range(10):
+            middleware(RequestFactory().get('/comments/'))
+            self.assertIsNone(routers._state.replica)
+        self.assertTrue(all(len(set(x)) == 1 for x in reads))
+
+    def test_lagging_replica(self):
+        # Two file databases, the replica is a copy of the primary taken
+        # before the thread exists, i.e. a replica lagging behind writes.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary, replica = [
+            os.path.join(directory, x + '.sqlite3') for x in ('primary', 'replica')
+        ]
+        with open(os.path.join(directory, 'replica_settings.py'), 'w') as f:
+            f.write(REPLICA_SETTINGS.format(
+                settings=settings.SETTINGS_MODULE, primary=primary,
+                replica=replica
+            ))
+        open(replica, 'w').close()
+        env = dict(
+            os.environ, DJANGO_SETTINGS_MODULE='replica_settings',
+            PYTHONPATH=os.pathsep.join([directory, settings.BASE_DIR])
+        )
+        manage = os.path.join(settings.BASE_DIR, 'manage.py')
+        # Data migrations must not read from the empty replica
+        subprocess.check_call(
+            [sys.executable, manage, 'migrate', '-v', '0'], env=env
+        )
+        shutil.copy(primary, replica)
+        output = subprocess.check_output(
+            [sys.executable, '-c', REPLICA_SCRIPT], env=env
+        )
+        self.assertEqual(json.loads(output), {
+            'lagging': True, 'path': True, 'closures': 3, 'left': 1
+        })
+
+
+class SubscribersCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            USER_MODEL.objects.create(username='subscriber_{}'.format(i))
+            for i in range(3)
+        ]
+        self.post = Post.objects.create()
+        self.post.subscribers.add(self.users[2], self.users[0])
+        self.ct_post = ContentType.objects.get_for_model(Post)
+
+    def test_index(self):
+        ids = get_subscriber_ids(self.ct_post.pk, self.post.pk)
+        self.assertEqual(list(ids), [self.users[0].pk, self.users[2].pk])
+        with self.assertNumQueries(0):
+            get_subscriber_ids(self.ct_post.pk, self.post.pk)
+
+    def test_invalidation(self):
+        get_subscriber_ids(self.ct_post.pk, self.post.pk)
+        self.post.subscribers.remove(self.users[0])
+        self.assertEqual(
+            list(get_subscriber_ids(self.ct_post.pk, self.post.pk)),
+            [self.users[2].pk]
+        )
+
+        self.users[1].subscriptions_posts.add(self.post)
+        self.assertEqual(
+            list(get_subscriber_ids(self.ct_post.pk, self.post.pk)),
+            [self.users[1].pk, self.users[2].pk]
+        )
+
+        self.users[1].subscriptions_posts.clear()
+        self.assertEqual(
+            list(get_subscriber_ids(self.ct_post.pk, self.post.pk)),
+            [self.users[2].pk]
+        )
+
+    def test_clear_race(self):
+        # A read between pre_clear and the delete caches old subscribers
+        def read(sender, action, **kwargs):
+            if action == 'pre_clear':
+                get_subscriber_ids(self.ct_post.pk, self.post.pk)
+
+        m2m_changed.connect(read, sender=Post.subscribers.through)
+        self.addCleanup(m2m_changed.disconnect, read,
+                        sender=Post.subscribers.through)
+        self.users[0].subscriptions_posts.clear()
+        self.assertEqual(
+            list(get_subscriber_ids(self.ct_post.pk, self.post.pk)),
+            [self.users[2].pk]
+        )
+        self.post.subscribers.clear()
+        self.assertEqual(
+            list(get_subscriber_ids(self.ct_post.pk, self.post.pk)), []
+        )
+
+    def test_notification_fanout(self):
+        root = Comment(owner=self.post, body='Root')
+        root.save()
+        reply = Comment(parent=root, body='Reply')
+        reply.save()
+        # Closures and the owner come from the DB, subscribers from cache
+        with self.assertNumQueries(2):
+            NotifyTask(reply).run()
+
+
+def skip_unless_fts(test):
+    """
+    ``skipUnless(fts_available())`` checked against the test database when
+    the test runs, it does not exist yet when the class is defined.
+    """
+    @wraps(test)
+    def wrapper(self, *args, **kwargs):
+        if not fts_available():
+            self.skipTest('SQLite is built without FTS5')
+        return test(self, *args, **kwargs)
+    return wrapper
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.post = Post.objects.create()
+        self.ct_post = ContentType.objects.get_for_model(Post)
+        self.root = Comment(owner=self.post, body='Apples and pears')
+        self.root.save()
+        self.reply = Comment(parent=self.root, body='I like apples apples')
+        self.reply.save()
+        Comment(owner=Photo.objects.create(), body='Apples on a photo').save()
+
+    def search(self, **params):
+        response = self.client.get(reverse('comments_search'), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    @skip_unless_fts
+    def test_ranked_pages(self):
+        data = self.search(q='apples', limit=2)
+        self.assertEqual(data['object_list'][0]['id'], self.reply.pk)
+        self.assertIn('<b>apples</b>', data['object_list'][0]['snippet'])
+        data = self.search(q='apples', limit=2, cursor=data['next_cursor'])
+        self.assertEqual(len(data['object_list']), 1)
+        self.assertIsNone(data['next_cursor'])
+
+        data = self.search(
+            q='apples', owner_type=self.ct_post.pk, owner_id=self.post.pk
+        )
+        self.assertEqual(
+            sorted(x['id'] for x in data['object_list']),
+            [self.root.pk, self.reply.pk]
+        )
+
+        # FTS matches every word wherever it is
+        data = self.search(q='pears apples')
+        self.assertEqual([x['id'] for x in data['object_list']],
+                         [self.root.pk])
+
+        response = self.client.get(reverse('comments_search'), {
+            'q': 'apples', 'owner_type': self.ct_post.pk
+        })
+        self.assertEqual(response.status_code, 406)
+        for limit in (0, -1, app_settings.PAGE_MAX_LIMIT + 1):
+            response = self.client.get(reverse('comments_search'), {
+                'q': 'apples', 'limit': limit
+            })
+            self.assertEqual(response.status_code, 406)
+
+    def test_like_fallback(self):
+        self.addCleanup(setattr, search_module, 'fts_available',
+                        fts_available)
+        search_module.fts_available = lambda: False
+        data = self.search(q='apples', limit=2)
+        self.assertEqual([x['id'] for x in data['object_list']],
+                         [self.root.pk, self.reply.pk])
+        self.assertIsNone(data['object_list'][0]['snippet'])
+        data = self.search(q='apples', limit=2, cursor=data['next_cursor'])
+        self.assertEqual(len(data['object_list']), 1)
+        self.assertIsNone(data['next_cursor'])
+
+        # Unlike FTS, LIKE matches the whole phrase only
+        data = self.search(q='apples apples')
+        self.assertEqual([x['id'] for x in data['object_list']],
+                         [self.reply.pk])
+        self.assertEqual(self.search(q='pears apples')['object_list'], [])
+
+    @skip_unless_fts
+    def test_fts_available_cache(self):
+        reset_fts_available()
+        self.assertTrue(fts_available())
+        with self.assertNumQueries(0):
+            fts_available()
+
+        # A database without the index is not introspected again either
+        reset_fts_available()
+        connection.introspection.table_names = lambda *args: []
+        try:
+            self.assertFalse(fts_available())
+        finally:
+            del connection.introspection.table_names
+        self.assertFalse(fts_available())
+        reset_fts_available()
+        self.assertTrue(fts_available())
+
+    @skip_unless_fts
+    def test_sync(self):
+        self.reply.body = 'Oranges only'
+        self.reply.save()
+        self.assertEqual(len(self.search(q='apples')['object_list']), 2)
+        self.assertEqual(len(self.search(q='oranges')['object_list']), 1)
+
+        self.root.delete()
+        self.assertEqual(len(self.search(q='oranges')['object_list']), 0)
+
+        call_command('rebuild_search_index', stdout=open(os.devnull, 'w'))
+        self.assertEqual(len(self.search(q='apples')['object_list']), 1)
+
+
+class RepliesFeedTests(TestCase):
+    def setUp(self):
+        self.author = USER_MODEL.objects.create(username='author')
+        self.replier = USER_MODEL.objects.create(username='replier')
+        self.root = Comment(
+            owner=Post.objects.create(), body='Root', user=self.author
+        )
+        self.root.save()
+
+    def reply(self, user, parent=None):
+        comment = Comment(parent=parent or self.root, body='Reply', user=user)
+        comment.save()
+        return comment
+
+    def test_feed(self):
+        replies = [self.reply(self.replier) for _ in range(3)]
+        # Own replies and replies to others are not in the feed
+        self.reply(self.author)
+        self.reply(self.author, parent=replies[0])
+
+        url = reverse('user_replies', args=(self.author.pk,))
+        data = json.loads(self.client.get(url, {'limit': 2}).content)
+        self.assertEqual(
+            [x['id'] for x in data['object_list']],
+            [replies[2].pk, replies[1].pk]
+        )
+        data = json.loads(self.client.get(
+            url, {'limit': 2, 'cursor': data['next_cursor']}
+        ).content)
+        self.assertEqual(
+            [x['id'] for x in data['object_list']], [replies[0].pk]
+        )
+        self.assertIsNone(data['next_cursor'])
+
+        # Bad limits are form errors
+        for limit in (-1, 0, app_settings.PAGE_MAX_LIMIT + 1):
+            response = self.client.get(url, {'limit': limit})
+            self.assertIn('limit', json.loads(response.content))
+
+    def test_retention(self):
+        limit = app_settings.REPLY_FEED_LIMIT
+        app_settings.REPLY_FEED_LIMIT = 2
+        try:
+            replies = [self.reply(self.replier) for _ in range(4)]
+        finally:
+            app_settings.REPLY_FEED_LIMIT = limit
+        self.assertEqual(
+            list(ReplyFeedEntry.objects.filter(user=self.author)
+                 .order_by('id').values_list('comment_id', flat=True)),
+            [replies[2].pk, replies[3].pk]
+        )
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        self.user = USER_MODEL.objects.create(username='writer')
+        self.post = Post.objects.create()
+        self.limits = app_settings.RATE_LIMITS
+        get_store().clear()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        app_settings.RATE_LIMITS = self.limits
+        app_settings.ADMISSION_MAX_LATENCY_MS = None
+        admission.latency_ms = 0.0
+        admission.updated_at = time.time()
+
+    def create(self):
+        return self.client.post(reverse('comment_list'), data=json.dumps({
+            'body': 'Spam',
+            'user': self.user.pk,
+            'owner_type': ContentType.objects.get_for_model(Post).pk,
+            'owner_id': self.post.pk
+        }), content_type='application/json')
+
+    def test_token_bucket(self):
+        app_settings.RATE_LIMITS = {'user': (0.01, 2), 'ip': (100, 100)}
+        self.assertEqual(self.create().status_code, 302)
+        self.assertEqual(self.create().status_code, 302)
+        response = self.create()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '100')
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def test_spoofed_user(self):
+        # Anonymous writes naming a user do not drain the bucket of that user
+        app_settings.RATE_LIMITS = {'user': (0.01, 1)}
+        self.client.logout()
+        for _ in range(2):
+            self.assertEqual(self.create().status_code, 302)
+        self.client.force_login(self.user)
+        self.assertEqual(self.create().status_code, 302)
+        self.assertEqual(self.create().status_code, 429)
+
+    def test_all_buckets_or_none(self):
+        # A write rejected by the ip bucket leaves the user bucket intact
+        app_settings.RATE_LIMITS = {'user': (0.01, 2), 'ip': (0.01, 1)}
+        self.assertEqual(self.create().status_code, 302)
+        self.assertEqual(self.create().status_code, 429)
+        app_settings.RATE_LIMITS = {'user': (0.01, 2)}
+        self.assertEqual(self.create().status_code, 302)
+        self.assertEqual(self.create().status_code, 429)
+
+    def test_admission_control(self):
+        app_settings.ADMISSION_MAX_LATENCY_MS = 100
+        admission.latency_ms = 200.0
+        admission.updated_at = time.time()
+        for _ in range(5):
+            response = self.create()
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+
+        # The estimate decays with time since the last write, not with the
+        # number of shed writes
+        admission.updated_at -= 2 * app_settings.ADMISSION_RETRY_AFTER
+        self.assertEqual(self.create().status_code, 302)
+        self.assertLess(admission.latency_ms, 100)
+
+
+class HotThreadsTests(TransactionTestCase):
+    # Trees are pre-rendered once writes commit
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        # Ids start over after every test, so does the tracker
+        self.read_threshold = app_settings.HOT_READ_THRESHOLD
+        app_settings.HOT_READ_THRESHOLD = 3
+        hot_threads.reset()
+        cache.clear()
+        self.user = USER_MODEL.objects.create(username='reader')
+        self.post = Post.objects.create()
+        self.root = Comment.objects.create(
+            body='Root', user=self.user, owner=self.post
+        )
+
+    def tearDown(self):
+        app_settings.HOT_READ_THRESHOLD = self.read_threshold
+        hot_threads.reset()
+
+    def read(self):
+        return self.client.get(reverse('comment_detail', kwargs={
+            'pk': self.root.pk
+        }), data={'full_tree': 1}).json()
+
+    def test_shared_cache_check(self):
+        self.assertEqual(
+            [x.id for x in check_hot_cache(None)], ['comments.W001']
+        )
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+        }}):
+            self.assertEqual(check_hot_cache(None), [])
+
+    def test_read_before_commit(self):
+        for _ in range(3):
+            self.read()
+        stale = render_tree(self.root)
+        with transaction.atomic():
+            Comment.objects.create(
+                body='Reply', user=self.user, parent=self.root,
+                owner=self.post
+            )
+            # A reader on another connection still renders the old tree
+            hot_threads.cache.set(hot_threads.tree_key(self.root), stale)
+        self.assertEqual(len(self.read()['childs']), 1)
+
+    def test_space_saving(self):
+        sketch = SpaceSaving(2)
+        for key in 'aab':
+            sketch.offer(key)
+        self.assertEqual(sketch.offer('c'), 'b')
+        self.assertEqual(sketch.top(), [('a', 2), ('c', 2)])
+        sketch.decay()
+        self.assertEqual(sketch.top(), [('a', 1), ('c', 1)])
+
+    def test_prerendered_tree(self):
+        for _ in range(3):
+            self.read()
+        self.assertTrue(hot_threads.is_hot(self.root.pk))
+
+        # Hot threads are served from the cache until the next write
+        self.read()
+        Comment.objects.filter(pk=self.root.pk).update(body='Stale')
+        self.assertEqual(self.read()['body'], 'Root')
+        Comment.objects.create(
+            body='Reply', user=self.user, parent=self.root, owner=self.post
+        )
+        # The write rendered the new tree before anyone read it
+        self.assertEqual(
+            json.loads(hot_threads.cache.get(hot_threads.tree_key(self.root))),
+            self.read()
+        )
+        data = self.read()
+        self.assertEqual(data['body'], 'Stale')
+        self.assertEqual(len(data['childs']), 1)
+
+        threads = self.client.get(reverse('comments_hot')).json()['threads']
+        self.assertEqual(threads[0]['root_id'], self.root.pk)
+        self.assertTrue(threads[0]['hot'])
+
+    def test_notification_digest(self):
+        self.post.subscribers.add(self.user)
+        for _ in range(3):
+            self.read()
+        for body in ('First', 'Second'):
+            Comment.objects.create(
+                body=body, user=self.user, parent=self.root, owner=self.post
+            )
+        dirpath = os.path.join(settings.MEDIA_ROOT, 'notify',
+                               'user_{}'.format(self.user.pk))
+        self.assertEqual(os.listdir(dirpath),
+                         ['digest_thread_{}'.format(self.root.pk)])
+        with open(os.path.join(dirpath, os.listdir(dirpath)[0])) as fin:
+            self.assertEqual(len(fin.readlines()), 2)
+
+
+class BatchReadTests(TestCase):
+    def setUp(self):
+        user = USER_MODEL.objects.create(username='batch')
+        post = Post.objects.create()
+        self.root = Comment.objects.create(body='Root', user=user, owner=post)
+        self.child = Comment.objects.create(
+            body='Child', user=user, parent=self.root, owner=post
+        )
+        self.grandchild = Comment.objects.create(
+            body='Grandchild', user=user, parent=self.child, owner=post
+        )
+
+    def batch(self, items):
+        return self.client.post(
+            reverse('comments_batch'), data=json.dumps({'items': items}),
+            content_type='application/json'
+        )
+
+    def test_batch(self):
+        items = [
+            {'id': self.root.pk, 'full_tree': True, 'max_depth': 1},
+            {'id': self.child.pk, 'full_tree': True},
+            self.grandchild.pk,
+            999,
+            {'id': self.root.pk + 1000, 'max_depth': -1},
+        ]
+        with self.assertNumQueries(3):
+            response = self.batch(items)
+        results = response.json()['results']
+        self.assertEqual(sorted(results), sorted([
+            str(self.root.pk), str(self.child.pk), str(self.grandchild.pk),
+            '999', str(self.root.pk + 1000)
+        ]))
+
+        root = results[str(self.root.pk)]
+        self.assertEqual(len(root['childs']), 1)
+        self.assertEqual(root['childs'][0]['childs'], [])
+        # Nested requests get their own complete subtree
+        child = results[str(self.child.pk)]
+        self.assertEqual(child['childs'][0]['id'], self.grandchild.pk)
+        self.assertNotIn('childs', results[str(self.grandchild.pk)])
+        self.assertEqual(results['999'], {'error': 'Not found'})
+        self.assertIn('max_depth',
+                      results[str(self.root.pk + 1000)]['errors'])
+
+    def test_invalid(self):
+        app_settings.BATCH_MAX_IDS, limit = 2, app_settings.BATCH_MAX_IDS
+        try:
+            self.assertEqual(self.batch([1, 2, 3]).status_code, 406)
+        finally:
+            app_settings.BATCH_MAX_IDS = limit
+        self.assertEqual(self.batch({'id': 1}).status_code, 406)
+
+        response = self.client.post(reverse('comments_batch'), data={
+            'id': [self.root.pk, self.child.pk]
+        })
+        self.assertEqual(len(response.json()['results']), 2)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = USER_MODEL.objects.create(username='archivist')
+        self.post = Post.objects.create()
+        self.root = Comment.objects.create(
+            body='Old', user=self.user, owner=self.post
+        )
+        self.child = Comment.objects.create(
+            body='Old reply', user=self.user, parent=self.root,
+            owner=self.post
+        )
+        self.child.body = 'Edited reply'
+        self.child.save()
+        Comment.objects.create(
+            body='Old answer', user=self.user, parent=self.child,
+            owner=self.post
+        )
+        Comment.objects.filter(pk__lte=self.child.pk + 1).update(
+            update_at=timezone.now() - timedelta(days=400)
+        )
+        self.live = Comment.objects.create(
+            body='New', user=self.user, owner=self.post
+        )
+        self.detail = reverse('comment_detail', kwargs={'pk': self.child.pk})
+
+    def archive(self):
+        out = StringIO()
+        call_command('archive_comments', days=365, stdout=out)
+        self.assertEqual(out.getvalue().strip(),
+                         'Archived 1 threads, 3 comments')
+
+    def test_archive(self):
+        before = self.client.get(self.detail, {'full_tree': 1}).json()
+        self.archive()
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(CommentClosure.objects.count(), 1)
+        self.assertEqual(self.client.get(self.detail, {'full_tree': 1}).json(),
+                         before)
+        url = reverse('comment_list')
+        response = self.client.get(url, {'full_tree': 1, 'stream': 1})
+        self.assertEqual(
+            json.loads(b''.join(response.streaming_content)),
+            self.client.get(url, {'full_tree': 1}).json()
+        )
+
+        data = self.client.get(reverse('comment_list'), {
+            'owner_type': ContentType.objects.get_for_model(Post).pk,
+            'owner_id': self.post.pk, 'limit': 1, 'offset': 1
+        }).json()
+        self.assertEqual(data['total_count'], 2)
+        self.assertEqual(data['object_list'][0]['id'], self.live.pk)
+
+        data = self.client.get(reverse('user_comments', kwargs={
+            'pk': self.user.pk
+        })).json()
+        self.assertEqual(data['total_count'], 4)
+        self.assertEqual(data['object_list'][0]['id'], self.root.pk)
+
+        ThreadSummary.refresh(ContentType.objects.get_for_model(Post).pk,
+                              self.post.pk)
+        summary = ThreadSummary.objects.get()
+        self.assertEqual(summary.comment_count, 4)
+        self.assertEqual(summary.participant_count, 1)
+
+    def test_restore_on_reply(self):
+        create_at = Comment.objects.get(pk=self.child.pk).create_at
+        self.archive()
+        response = self.client.post(reverse('comment_list'), data=json.dumps({
+            'body': 'Revived',
+            'user': self.user.pk,
+            'parent': self.child.pk,
+            'owner_type': ContentType.objects.get_for_model(Post).pk,
+            'owner_id': self.post.pk
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(ArchivedThread.objects.exists())
+        self.assertEqual(Comment.objects.get(pk=self.child.pk).create_at,
+                         create_at)
+        self.assertEqual(HistoryComment.objects.count(), 1)
+        self.assertEqual(
+            len(self.client.get(self.detail, {'full_tree': 1})
+                .json()['childs']), 2
+        )
+        self.assertEqual(
+            CommentClosure.objects.filter(parent=self.root).count(), 4
+        )
+
+
+    def test_archived_reads(self):
+        live = {
+            'detail': self.client.get(self.detail).json(),
+            'thread': self.client.get(reverse(
+                'comment_thread', args=(self.root.pk,)
+            ), {'after': self.root.pk}).json()
+        }
+        self.archive()
+        results = self.client.post(reverse('comments_batch'), data=json.dumps({
+            'items': [self.child.pk, {'id': self.child.pk + 1},
+                      {'id': self.root.pk, 'full_tree': True, 'max_depth': 1}]
+        }), content_type='application/json').json()['results']
+        self.assertEqual(results[str(self.child.pk)], live['detail'])
+        self.assertNotIn('childs', results[str(self.child.pk + 1)])
+        root = results[str(self.root.pk)]
+        self.assertEqual(root['childs'][0]['id'], self.child.pk)
+        self.assertEqual(root['childs'][0]['childs'], [])
+
+        self.assertEqual(self.client.get(reverse(
+            'comment_thread', args=(self.child.pk,)
+        ), {'after': self.root.pk}).json(), live['thread'])
+        self.assertEqual(
+            [x['depth'] for x in self.client.get(reverse(
+                'comment_thread', args=(self.root.pk,)
+            )).json()['object_list']],
+            [0, 1, 2]
+        )
+        self.assertEqual(self.client.get(reverse(
+            'comment_thread', args=(self.root.pk,)
+        ), {'after': self.live.pk}).status_code, 404)
+
+    def test_restore_after_throttling(self):
+        self.archive()
+        limits = app_settings.RATE_LIMITS
+        self.addCleanup(setattr, app_settings, 'RATE_LIMITS', limits)
+        app_settings.RATE_LIMITS = {'user': (0.01, 0)}
+        get_store().clear()
+        self.client.force_login(self.user)
+        data = json.dumps({
+            'body': 'Rejected',
+            'user': self.user.pk,
+            'parent': self.child.pk,
+            'owner_type': ContentType.objects.get_for_model(Post).pk,
+            'owner_id': self.post.pk
+        })
+        response = self.client.post(reverse('comment_list'), data=data,
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        response = self.client.put(self.detail, data=data,
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(ArchivedThread.objects.exists())
+
+    def test_newest_thread_and_reply_feed(self):
+        other = USER_MODEL.objects.create(username='replier')
+        reply = Comment.objects.create(
+            body='Old feedback', user=other, parent=self.child,
+            owner=self.post
+        )
+        Comment.objects.filter(pk=reply.pk).update(
+            update_at=timezone.now() - timedelta(days=400)
+        )
+        entries = list(ReplyFeedEntry.objects.values_list(
+            'id', 'user', 'comment'
+        ))
+        self.assertEqual(len(entries), 1)
+
+        # The thread holds the newest id, ids are never handed out again
+        call_command('archive_comments', days=365, stdout=StringIO())
+        self.assertFalse(ReplyFeedEntry.objects.exists())
+        self.assertGreater(
+            Comment.objects.create(body='Newer', user=other).pk, reply.pk
+        )
+
+        call_command('archive_comments', restore=reply.pk, stdout=StringIO())
+        self.assertEqual(list(ReplyFeedEntry.objects.values_list(
+            'id', 'user', 'comment'
+        )), entries)
+        data = self.client.get(reverse('user_replies', kwargs={
+            'pk': self.user.pk
+        })).json()
+        self.assertEqual([x['id'] for x in data['object_list']], [reply.pk])
+
+
+class CompactTreeTests(TestCase):
+    def setUp(self):
+        self.root = Comment.objects.create(body='Root')
+        self.first = Comment.objects.create(body='First', parent=self.root)
+        self.leaf = Comment.objects.create(body='Leaf', parent=self.first)
+        self.second = Comment.objects.create(body='Second', parent=self.root)
+
+    def test_build(self):
+        with self.assertNumQueries(3):
+            tree = CompactTree.from_comment(self.root, chunk_size=2)
+        self.assertEqual(tree.ids.tolist(), [
+            self.root.pk, self.first.pk, self.leaf.pk, self.second.pk
+        ])
+        self.assertEqual(tree.ids.typecode, 'l')
+        self.assertEqual(tree.parent.tolist(), [-1, 0, 1, 0])
+        self.assertEqual(tree.depth.tolist(), [0, 1, 2, 1])
+        self.assertEqual(list(tree.children(0)), [1, 3])
+
+        subtree = CompactTree.from_comment(self.first)
+        self.assertEqual(subtree.ids.tolist(), [self.first.pk, self.leaf.pk])
+
+    def test_traversals(self):
+        tree = CompactTree.from_comment(self.root)
+        self.assertEqual(tree.subtree(1), (1, 3))
+        self.assertEqual(list(tree.dfs(3)), [3])
+        self.assertEqual(len(list(tree.dfs())), 4)
+        self.assertEqual(list(tree.ancestors(2)), [1, 0])
+        self.assertEqual(tree.index(self.second.pk), 3)
+        self.assertRaises(KeyError, tree.index, self.second.pk + 1)
+
+        # Sorted runs are merged into one index
+        shuffled = CompactTree()
+        for pk, depth in [(7, 0), (3, 1), (9, 2), (1, 1), (5, 2), (2, 1)]:
+            shuffled.append(pk, depth)
+        shuffled._build_index(run_size=2)
+        self.assertEqual(shuffled._sorted_ids.tolist(), [1, 2, 3, 5, 7, 9])
+        self.assertEqual([shuffled.index(x) for x in shuffled.ids], range(6))
+
+        with self.assertNumQueries(2):
+            bodies = [x[0] for _, x in tree.values(start=1, chunk_size=2)]
+        self.assertEqual(bodies, ['First', 'Leaf', 'Second'])
+
+        # A comment deleted meanwhile takes its subtree along
+        Comment.objects.filter(pk=self.first.pk).delete()
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                [(i, x.pk) for i, x in tree.comments(chunk_size=2)],
+                [(0, self.root.pk), (3, self.second.pk)]
+            )
@@ -10,18 +10,37 @@ __date__ = "Dec 09, 2016"
 from django.conf.urls import url
 
 from .views import (
-    CommentListView, CommentDetailView,
-    UserCommentListView, CommentsDumpView, AsyncDumpResultView
+    CommentListView, CommentDetailView, CommentThreadView,
+    UserCommentListView, CommentsDumpView, AsyncDumpResultView, MetricsView,
+    HotThreadsView, ThreadSummaryView, CommentSearchView, UserRepliesFeedView,
+    CommentBatchView
 )
 
 urlpatterns = [
     url(r'^comments/dump/(?P<pk>\d+)/$',
         AsyncDumpResultView.as_view(), name='comments_dump_result'
     ),
+    url(r'^comments/batch/$',
+        CommentBatchView.as_view(), name='comments_batch'
+    ),
+    url(r'^comments/search/$',
+        CommentSearchView.as_view(), name='comments_search'
+    ),
+    url(r'^comments/summary/$',
+        ThreadSummaryView.as_view(), name='comments_summary'
+    ),
+    url(r'^comments/metrics/$', MetricsView.as_view(), name='comments_metrics'),
+    url(r'^comments/hot/$', HotThreadsView.as_view(), name='comments_hot'),
     url(r'^comments/dump/$', CommentsDumpView.as_view(), name='comments_dump'),
+    url(r'^comments/user/(?P<pk>\d+)/replies/$',
+        UserRepliesFeedView.as_view(), name='user_replies'
+    ),
     url(r'^comments/user/(?P<pk>\d+)/$',
         UserCommentListView.as_view(), name='user_comments'
     ),
+    url(r'^comments/(?P<pk>\d+)/thread/$',
+        CommentThreadView.as_view(), name='comment_thread'
+    ),
     url(r'^comments/(?P<pk>\d+)/$',
         CommentDetailView.as_view(), name='comment_detail'
     ),
@@ -14,10 +14,11 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 
-from .models import Comment
-from .settings import DUMP_BACKENDS
-
-USER_MODEL = get_user_model()
+from .hotness import hot_threads
+from .loading import dump_backends
+from .models import Comment, resolve_owners
+from .routers import db_for_dump
+from .subscribers import get_subscriber_ids
 
 
 class CreateCommentList(Thread):
@@ -26,7 +27,7 @@ class CreateCommentList(Thread):
 
     def run(self):
         qs = Comment.objects.none()
-        ct_user = ContentType.objects.get_for_model(USER_MODEL)
+        ct_user = ContentType.objects.get_for_model(get_user_model())
         if self.acd.owner_type == ct_user:
             qs = Comment.objects.filter(
                 user=self.acd.owner
@@ -39,8 +40,9 @@ class CreateCommentList(Thread):
             qs = qs.filter(create_at__gte=self.acd.start_at)
         if self.acd.end_at:
             qs = qs.filter(create_at__lte=self.acd.end_at)
+        qs = qs.using(db_for_dump())
 
-        for b_cls in DUMP_BACKENDS:
+        for b_cls in dump_backends():
             backend = b_cls(qs)
             filepath = os.path.join(
                 settings.MEDIA_ROOT,
@@ -64,19 +66,37 @@ class NotifyTask(Thread):
         self.comment = comment
 
     def run(self):
-        qs = self.comment.parents.filter(parent__owner_id__isnull=False)
-        for closure in qs:
-            for user in closure.parent.owner.subscribers.all():
+        qs = self.comment.parents.filter(parent__owner_id__isnull=False)\
+            .select_related('parent')
+        closures = list(qs)
+        resolve_owners(x.parent for x in closures)
+        # Hot threads append to one digest per user instead of a file
+        # per comment
+        root_id = self.comment.root_id
+        digest = hot_threads.is_hot(root_id)
+        notified = set()
+        for closure in closures:
+            user_ids = get_subscriber_ids(
+                closure.parent.owner_type_id, closure.parent.owner_id
+            )
+            if not user_ids:
+                continue
+            message = 'New comment for {}'.format(closure.parent.owner)
+            if digest:
+                message = '{}: {}\n'.format(message, self.comment)
+            for user_id in user_ids:
+                if digest and user_id in notified:
+                    continue
+                notified.add(user_id)
                 filename = os.path.join(
                     settings.MEDIA_ROOT, 'notify',
-                    'user_{}'.format(user.pk),
+                    'user_{}'.format(user_id),
+                    'digest_thread_{}'.format(root_id) if digest else
                     'notify_about_{}'.format(self.comment)
                 )
                 dirpath = os.path.dirname(filename)
                 if not os.path.exists(dirpath):
                     os.makedirs(dirpath)
 
-                with open(filename, 'wb+') as fout:
-                    fout.write(
-                        'New comment for {}'.format(closure.parent.owner)
-                    )
+                with open(filename, 'ab' if digest else 'wb+') as fout:
+                    fout.write(message)
@@ -10,17 +10,61 @@ __email__ = "mfs90@mail.ru"
 __date__ = "Dec 09, 2016"
 
 import json
+import math
+import time
+from collections import OrderedDict
+from functools import reduce
+from itertools import chain
+from operator import or_
 
 from django.views.generic import ListView, DetailView, TemplateView
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import (
+    HttpResponse, JsonResponse, HttpResponseRedirect, Http404,
+    StreamingHttpResponse
+)
+from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
+from django.db.models import Q
 from django.forms import modelform_factory
-
-from .models import Comment, AsyncCommentsDump
-from .req_forms import DumpForm, ListForm
-from .utils import CreateCommentList
-
-CommentForm = modelform_factory(Comment, fields=('user', 'parent', 'owner_type', 'owner_id', 'body'))
+from django.utils import six
+from django.utils.lru_cache import lru_cache
+
+from . import settings as app_settings
+from .archive import restore_thread
+from .hotness import hot_threads
+from .loading import load
+from .metrics import registry, count_nodes
+from .models import (
+    ArchivedComment, ArchivedThread, Comment, AsyncCommentsDump,
+    ReplyFeedEntry, ThreadSummary, PATH_STEP, path_range, resolve_owners,
+    trees_to_dict
+)
+from .req_forms import (
+    BatchForm, BatchItemForm, DumpForm, FeedForm, ListForm, SearchForm,
+    SummaryForm, ThreadForm
+)
+from .search import search
+from .ratelimit import admission, throttle_write
+from .sqlite import submit_write
+from .streaming import (
+    iter_json, streamed_list, streamed_tree, streamed_trees
+)
+
+@lru_cache(maxsize=None)
+def get_comment_form():
+    # Built on first use instead of at import time
+    return modelform_factory(Comment, fields=('user', 'parent', 'owner_type', 'owner_id', 'body'))
+
+
+def archived_thread(comment_id):
+    """
+    Archived thread holding ``comment_id``, None when it is not archived.
+    """
+    try:
+        return ArchivedThread.objects.filter(comments__id=int(comment_id))\
+            .first()
+    except (TypeError, ValueError):
+        return None
 
 
 # Mixin class from Django Documentation.
@@ -28,14 +72,25 @@ class JSONResponseMixin(object):
     """
     A mixin that can be used to render a JSON response.
     """
+    stream = False
+
     def render_to_json_response(self, context, **response_kwargs):
         """
         Returns a JSON response, transforming 'context' to make the payload.
         """
-        return JsonResponse(
-            self.get_data(context),
-            **response_kwargs
-        )
+        if self.stream:
+            return StreamingHttpResponse(
+                iter_json(self.get_data(context)),
+                content_type='application/json', **response_kwargs
+            )
+        start = time.time()
+        data = self.get_data(context)
+        response = JsonResponse(data, **response_kwargs)
+        metrics = getattr(self.request, 'comments_metrics', None)
+        if metrics is not None:
+            metrics['encode_ms'] += (time.time() - start) * 1000
+            metrics['tree_size'] += count_nodes(data)
+        return response
 
     def get_data(self, context):
         """
@@ -48,7 +103,59 @@ class JSONResponseMixin(object):
         return context
 
 
-class CommentListView(JSONResponseMixin, ListView):
+class WriteThrottleMixin(object):
+    """
+    Rate limiting and admission control of comment writes.
+    """
+    def throttle_write(self, cleaned_data, instance=None, root_id=None):
+        """
+        Returns a 429 response when the write is rate limited or shed by
+        admission control, otherwise None.
+        """
+        retry_after = admission.admit() or throttle_write(
+            self.request, cleaned_data, instance, root_id
+        )
+        if retry_after is None:
+            return None
+        response = self.render_to_json_response(
+            {'error': 'Too many requests'}, status=429
+        )
+        response['Retry-After'] = '{:d}'.format(int(math.ceil(retry_after)))
+        return response
+
+    def comment_form(self, data, pk=None):
+        """
+        Binds the form of a new comment or of comment ``pk`` and checks the
+        write. Returns the form and a 429 response when the write is
+        rejected. A thread archived since the client loaded it, holding
+        ``pk`` or the parent, is restored only once the write is admitted.
+        """
+        CommentForm = get_comment_form()
+        instance, archived = None, None
+        if pk is not None:
+            instance = Comment.objects.filter(pk=pk).first()
+            if instance is None:
+                archived = archived_thread(pk)
+                if archived is None:
+                    raise Http404
+        form = CommentForm(data, instance=instance)
+        if not form.is_valid():
+            if archived is None and set(form.errors) == {'parent'}:
+                archived = archived_thread(data.get('parent'))
+            if archived is None:
+                return form, None
+        rejected = self.throttle_write(
+            form.cleaned_data, instance, archived and archived.root_id
+        )
+        if rejected is None and archived is not None:
+            restore_thread(archived.root_id)
+            if pk is not None:
+                instance = Comment.objects.get(pk=pk)
+            form = CommentForm(data, instance=instance)
+        return form, rejected
+
+
+class CommentListView(JSONResponseMixin, WriteThrottleMixin, ListView):
     model = Comment
     queryset = Comment.objects.filter(parent__isnull=True)
     filter_fields = ('id', 'owner_type_id', 'owner_id')
@@ -68,16 +175,51 @@ class CommentListView(JSONResponseMixin, ListView):
             limit = cd.pop('limit') or 10
             offset = cd.pop('offset') or 0
             full_tree = cd.pop('full_tree', False)
+            self.stream = cd.pop('stream', False)
+            with_owner = cd.pop('with_owner', False)
+            filters = {k: v for k, v in cd.items() if v}
             queryset = kwargs.pop('object_list', self.object_list).filter(
-                **{k: v for k, v in cd.items() if v}
+                **filters
             )
 
+            # Archived threads are older than live ones and come first
+            archived_qs = ArchivedThread.objects.filter(**{
+                'comments__id' if k == 'id' else k: v
+                for k, v in filters.items()
+            }).order_by('started_at')
+            archived_count = archived_qs.count()
+            archived = []
+            if offset < archived_count:
+                archived = list(archived_qs[offset:offset + limit])
+                if with_owner:
+                    resolve_owners(archived)
+            archived = [
+                x.to_dict(cd['id'], full_tree, with_owner) for x in archived
+            ]
+            live_offset = max(offset - archived_count, 0)
+            page = queryset[live_offset:live_offset + limit - len(archived)]
+            if with_owner:
+                page = page.with_owners()
+            elif self.stream and not full_tree:
+                page = page.iterator()
+            if self.stream and full_tree:
+                object_list = streamed_trees(list(page), with_owner, archived)
+            elif self.stream:
+                object_list = streamed_list(chain(
+                    archived, (x.to_dict(False, with_owner) for x in page)
+                ))
+            elif full_tree:
+                object_list = archived + trees_to_dict(
+                    page, with_owner=with_owner
+                )
+            else:
+                object_list = archived + map(
+                    lambda x: x.to_dict(False, with_owner), page
+                )
+
             ctx = {
-                'total_count': queryset.count(),
-                'object_list': map(
-                    lambda x: x.to_dict(full_tree),
-                    queryset[offset:offset+limit]
-                ),
+                'total_count': queryset.count() + archived_count,
+                'object_list': object_list,
                 'limit': limit,
                 'offset': offset
             }
@@ -91,38 +233,83 @@ class CommentListView(JSONResponseMixin, ListView):
                 data = json.loads(request.body)
             else:
                 data = request.POST
-            form = CommentForm(data)
+            form, rejected = self.comment_form(data)
+            if rejected:
+                return rejected
             if form.is_valid():
-                obj = form.save()
+                obj = admission.run(submit_write, form.save)
                 return HttpResponseRedirect(obj.get_absolute_url())
             return self.render_to_json_response(form.errors)
         except ValueError as e:
             return self.render_to_json_response({'error': e.message})
 
 
-class CommentDetailView(JSONResponseMixin, DetailView):
+class CommentDetailView(JSONResponseMixin, WriteThrottleMixin, DetailView):
     model = Comment
+    rendered = None
 
     def render_to_response(self, context, **response_kwargs):
+        if self.rendered is not None:
+            return HttpResponse(self.rendered,
+                                content_type='application/json')
         return self.render_to_json_response(context, **response_kwargs)
 
+    def get(self, request, *args, **kwargs):
+        try:
+            response = super(CommentDetailView, self).get(
+                request, *args, **kwargs
+            )
+        except Http404:
+            archived = ArchivedComment.objects.filter(pk=self.kwargs['pk'])\
+                .select_related('thread').first()
+            if archived is None:
+                raise
+            return self.render_to_json_response(archived.thread.to_dict(
+                archived.pk, request.GET.get('full_tree', False) == '1',
+                request.GET.get('with_owner', False) == '1'
+            ))
+        hot_threads.record_read(self.object.root_id)
+        return response
+
+    def get_object(self, queryset=None):
+        try:
+            return super(CommentDetailView, self).get_object(queryset)
+        except Http404:
+            # Deleting brings an archived thread back to the live tables,
+            # other writes restore it in comment_form once admitted
+            if self.request.method != 'DELETE' or \
+                    not restore_thread(int(self.kwargs['pk'])):
+                raise
+            return super(CommentDetailView, self).get_object(queryset)
+
     def get_context_data(self, **kwargs):
         ctx = {}
         full_tree = self.request.GET.get('full_tree', False) == '1'
-        if self.object:
-            ctx = self.object.to_dict(full_tree)
+        with_owner = self.request.GET.get('with_owner', False) == '1'
+        self.stream = self.request.GET.get('stream', False) == '1'
+        if self.object and full_tree and not (with_owner or self.stream):
+            # Hot threads are served from a pre-rendered tree
+            self.rendered = hot_threads.rendered_tree(self.object)
+            if self.rendered is not None:
+                return ctx
+        if self.object and self.stream and full_tree:
+            ctx = streamed_tree(self.object, with_owner)
+        elif self.object:
+            ctx = self.object.to_dict(full_tree, with_owner)
         return ctx
 
     def put(self, request, *args, **kwargs):
-        self.object = self.get_object()
         try:
             if self.request.content_type == 'application/json':
                 data = json.loads(request.body)
             else:
                 data = request.POST
-            form = CommentForm(data, instance=self.object)
+            form, rejected = self.comment_form(data, self.kwargs['pk'])
+            if rejected:
+                return rejected
+            self.object = form.instance
             if form.is_valid():
-                form.save()
+                admission.run(submit_write, form.save)
                 return self.render_to_response(
                     self.get_context_data(object=self.object)
                 )
@@ -144,8 +331,199 @@ class CommentDetailView(JSONResponseMixin, DetailView):
         return self.render_to_json_response({'result': 'Success'})
 
 
+class CommentThreadView(JSONResponseMixin, DetailView):
+    """
+    Flat page of a comment thread in depth-first display order.
+    """
+    model = Comment
+    archived = None
+
+    def render_to_response(self, context, **response_kwargs):
+        return self.render_to_json_response(context, **response_kwargs)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            return super(CommentThreadView, self).get(
+                request, *args, **kwargs
+            )
+        except Http404:
+            self.archived = archived_thread(self.kwargs['pk'])
+            if self.archived is None:
+                raise
+            self.object = None
+            return self.render_to_response(self.get_context_data())
+
+    def archived_page(self, after, limit):
+        """
+        Page of an archived thread, its comments are stored in path order.
+        """
+        rows = self.archived.payload['comments']
+        if after:
+            index = next(
+                (i for i, x in enumerate(rows) if x['id'] == after), None
+            )
+            if index is None:
+                raise Http404
+            rows = rows[index + 1:]
+        return [
+            dict({k: v for k, v in x.items() if k != 'path'},
+                 depth=max(len(x['path']) // PATH_STEP - 1, 0))
+            for x in rows[:limit]
+        ]
+
+    def get_context_data(self, **kwargs):
+        form = ThreadForm(self.request.GET)
+        if not form.is_valid():
+            return dict(form.errors)
+        cd = form.cleaned_data
+        limit = cd['limit'] or 10
+        if self.archived is not None:
+            return {
+                'object_list': self.archived_page(cd['after'], limit),
+                'after': cd['after'],
+                'limit': limit
+            }
+        qs = self.model.objects.filter(
+            **path_range(self.object.path[:PATH_STEP])
+        ).order_by('path')
+        if cd['after']:
+            after = get_object_or_404(qs, pk=cd['after'])
+            qs = after.get_thread_window(limit)
+        else:
+            qs = qs[:limit]
+
+        object_list = []
+        for comment in qs:
+            dict_obj = comment.to_dict(False)
+            dict_obj['depth'] = comment.depth
+            object_list.append(dict_obj)
+        return {
+            'object_list': object_list,
+            'after': cd['after'],
+            'limit': limit
+        }
+
+
+class CommentBatchView(JSONResponseMixin, TemplateView):
+    """
+    Many comments or subtrees by id, keyed by id with per-item errors.
+    Comments are loaded with one ``in_bulk`` query and all requested
+    subtrees with one more, archived ones with a third.
+    """
+    def post(self, request, *args, **kwargs):
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body)
+            except ValueError as e:
+                return self.render_to_json_response(
+                    {'error': e.message}, status=406
+                )
+            if not isinstance(data, dict):
+                data = {}
+        else:
+            data = {'items': request.POST.getlist('id')}
+        form = BatchForm(data)
+        if not form.is_valid():
+            return self.render_to_json_response(dict(form.errors), status=406)
+
+        results, options = OrderedDict(), OrderedDict()
+        for item in form.cleaned_data['items']:
+            item_form = BatchItemForm(item)
+            if item_form.is_valid():
+                options[item_form.cleaned_data['id']] = item_form.cleaned_data
+                # Filled below, keeps the requested order
+                results[six.text_type(item_form.cleaned_data['id'])] = None
+            else:
+                results[six.text_type(item.get('id'))] = {
+                    'errors': dict(item_form.errors)
+                }
+
+        comments = Comment.objects.in_bulk(list(options))
+        trees = [
+            comments[pk] for pk, cd in options.items()
+            if cd['full_tree'] and pk in comments
+        ]
+        trees = dict(zip([x.pk for x in trees], trees_to_dict(
+            trees, max_depth={pk: cd['max_depth'] for pk, cd in options.items()}
+        )))
+        missing = [pk for pk in options if pk not in comments]
+        archived, threads = {}, {}
+        if missing:
+            for x in ArchivedComment.objects.select_related('thread')\
+                    .filter(pk__in=missing):
+                # Comments of a thread share its decompressed payload
+                archived[x.pk] = threads.setdefault(x.thread_id, x.thread)
+        for pk, cd in options.items():
+            if pk in trees:
+                result = trees[pk]
+            elif pk in comments:
+                result = comments[pk].to_dict(False)
+            elif pk in archived:
+                result = archived[pk].to_dict(
+                    pk, cd['full_tree'], max_depth=cd['max_depth']
+                )
+            else:
+                result = {'error': 'Not found'}
+            results[six.text_type(pk)] = result
+        return self.render_to_json_response({'results': results})
+
+
+class ThreadSummaryView(JSONResponseMixin, TemplateView):
+    """
+    Comment counters of many entities, in the order they were requested.
+    """
+    def get(self, request, *args, **kwargs):
+        form = SummaryForm(request.GET)
+        if not form.is_valid():
+            return self.render_to_json_response(dict(form.errors), status=406)
+        owners = form.cleaned_data['owners']
+        summaries = {}
+        if owners:
+            summaries = {
+                (x.owner_type_id, x.owner_id): x
+                for x in ThreadSummary.objects.filter(reduce(or_, [
+                    Q(owner_type_id=ct, owner_id=pk) for ct, pk in owners
+                ]))
+            }
+        return self.render_to_json_response({
+            'object_list': [
+                summaries.get(owner, ThreadSummary(
+                    owner_type_id=owner[0], owner_id=owner[1]
+                )).as_dict()
+                for owner in owners
+            ]
+        })
+
+
+class CommentSearchView(JSONResponseMixin, TemplateView):
+    def get(self, request, *args, **kwargs):
+        form = SearchForm(request.GET)
+        if not form.is_valid():
+            return self.render_to_json_response(dict(form.errors), status=406)
+        cd = form.cleaned_data
+        limit = cd['limit'] or 10
+        try:
+            object_list, next_cursor = search(
+                cd['q'],
+                owner_type_id=cd['owner_type'] and cd['owner_type'].pk,
+                owner_id=cd['owner_id'], user_id=cd['user'],
+                date_from=cd['date_from'], date_to=cd['date_to'],
+                cursor=cd['cursor'], limit=limit
+            )
+        except (TypeError, ValueError):
+            return self.render_to_json_response(
+                {'cursor': ['Invalid cursor']}, status=406
+            )
+        return self.render_to_json_response({
+            'object_list': object_list,
+            'next_cursor': next_cursor,
+            'limit': limit
+        })
+
+
 class UserCommentListView(JSONResponseMixin, DetailView):
-    model = get_user_model()
+    def get_queryset(self):
+        return get_user_model()._default_manager.all()
 
     def render_to_response(self, context, **response_kwargs):
         return self.render_to_json_response(context, **response_kwargs)
@@ -155,12 +533,27 @@ class UserCommentListView(JSONResponseMixin, DetailView):
         if self.object:
             # qs = self.model.objects.filter(parents__parent=self.object)
             qs = self.object.comment_set.all().order_by('create_at')
-            limit = self.request.GET.get('limit', 10)
-            offset = self.request.GET.get('offset', 0)
+            limit = int(self.request.GET.get('limit', 10))
+            offset = int(self.request.GET.get('offset', 0))
+            # Archived comments are older than live ones and come first
+            archived_qs = ArchivedComment.objects.filter(user=self.object)\
+                .select_related('thread').order_by('pk')
+            archived_count = archived_qs.count()
+            archived = []
+            if offset < archived_count:
+                # One instance per thread decompresses its payload once
+                threads = {}
+                archived = [
+                    threads.setdefault(x.thread_id, x.thread)
+                    .to_dict(x.pk, False)
+                    for x in archived_qs[offset:offset + limit]
+                ]
+            live_offset = max(offset - archived_count, 0)
+            page = qs[live_offset:live_offset + limit - len(archived)]
             ctx = {
-                'total_count': qs.count(),
-                'object_list': map(
-                    lambda x: x.to_dict(False), qs[offset:offset+limit]
+                'total_count': qs.count() + archived_count,
+                'object_list': archived + map(
+                    lambda x: x.to_dict(False), page
                 ),
                 'limit': limit,
                 'offset': offset
@@ -168,6 +561,35 @@ class UserCommentListView(JSONResponseMixin, DetailView):
         return ctx
 
 
+class UserRepliesFeedView(JSONResponseMixin, DetailView):
+    """
+    Replies to comments of a user, newest first, paged by cursor.
+    """
+    def get_queryset(self):
+        return get_user_model()._default_manager.all()
+
+    def render_to_response(self, context, **response_kwargs):
+        return self.render_to_json_response(context, **response_kwargs)
+
+    def get_context_data(self, **kwargs):
+        form = FeedForm(self.request.GET)
+        if not form.is_valid():
+            return dict(form.errors)
+        cd = form.cleaned_data
+        limit = cd['limit'] or 10
+        qs = ReplyFeedEntry.objects.filter(user=self.object)\
+            .select_related('comment').order_by('-id')
+        if cd['cursor']:
+            qs = qs.filter(id__lt=cd['cursor'])
+        entries = list(qs[:limit + 1])
+        return {
+            'object_list': [x.comment.to_dict(False) for x in entries[:limit]],
+            'next_cursor': entries[limit - 1].pk
+            if len(entries) > limit else None,
+            'limit': limit
+        }
+
+
 class CommentsDumpView(JSONResponseMixin, TemplateView):
     model = Comment
     queryset = Comment.objects.none()
@@ -198,7 +620,7 @@ class CommentsDumpView(JSONResponseMixin, TemplateView):
             'total_count': qs.count(),
             'object_list': map(
                 lambda x: x.as_dict(),
-                qs[offset:offset+limit]
+                qs.with_owners()[offset:offset+limit]
             ),
             'offset': offset,
             'limit': limit
@@ -226,7 +648,7 @@ class CommentsDumpView(JSONResponseMixin, TemplateView):
         acd = AsyncCommentsDump(owner=owner)
         acd.save()
 
-        async = CreateCommentList(acd)
+        async = load(app_settings.DUMP_TASK)(acd)
         async.run()
 
         return self.render_to_json_response({
@@ -254,3 +676,20 @@ class AsyncDumpResultView(JSONResponseMixin, TemplateView):
                 ctx['path'] = self.object.path.url
             return self.render_to_json_response(ctx)
         return self.render_to_json_response({})
+
+
+class MetricsView(JSONResponseMixin, TemplateView):
+    def get(self, request, *args, **kwargs):
+        if not app_settings.METRICS_ENABLED:
+            raise Http404('Metrics are disabled')
+        return self.render_to_json_response(registry.snapshot())
+
+
+class HotThreadsView(JSONResponseMixin, TemplateView):
+    """
+    Read and write rates of the hottest threads seen by this process.
+    """
+    def get(self, request, *args, **kwargs):
+        return self.render_to_json_response(
+            {'threads': hot_threads.snapshot()}
+        )